@@ -1,10 +1,1131 @@
 import appdaemon.plugins.hass.hassapi as hass
+import csv
 from datetime import timedelta, date, datetime, timezone
-from bs4 import BeautifulSoup
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from html.parser import HTMLParser
 import math
+import mmap
+import os
+import random
 import requests
+from requests.adapters import HTTPAdapter
+import struct
+import tempfile
+import threading
+import time
+from types import MappingProxyType
 import globals
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TideCache:
+    """ Process-wide cache for tide tables pulled from BOM.
+
+    All SensorTide instances share one cache, so a station configured more than
+    once (or with the same time zone) is only scraped once per refresh. Entries
+    expire after ttl seconds and the least recently used entry is dropped once
+    max_entries is reached. Concurrent loads of the same key wait for the one
+    in-flight fetch instead of starting their own.
+
+    Parameters
+    ----------
+    ttl: int
+        Lifetime of an entry in seconds
+    max_entries: int
+        Maximum number of tide tables kept
+    """
+    def __init__(self, ttl=3600, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """ Returns the cached value for key, calling loader on a miss.
+
+        Parameters:
+            key (tuple): Cache key (aac, tz, start date, days)
+            loader (callable): Function returning the value to cache
+
+        Returns:
+            TideTable: Cached tide information (shared, do not modify)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = {"done": threading.Event()}
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            # Another thread is fetching the same table, wait for its result
+            pending["done"].wait()
+            if "error" in pending:
+                raise pending["error"]
+            return pending["value"]
+
+        try:
+            value = loader()
+            pending["value"] = value
+            with self._lock:
+                self._entries[key] = (time.monotonic(), value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return value
+        except Exception as err:
+            pending["error"] = err
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending["done"].set()
+
+    def stats(self):
+        """ Returns the cache counters.
+
+        Returns:
+            dict: Hits, misses, coalesced loads and current size
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "coalesced": self.coalesced, "size": len(self._entries)}
+
+
+# Shared by all SensorTide instances of this process
+TIDE_CACHE = TideCache()
+
+# BOM tide print page
+BOM_URL = 'http://www.bom.gov.au/australia/tides/print.php'
+
+# Most days requested from BOM in one go
+MAX_FETCH_DAYS = 7
+
+# How far ahead tide triggers are scheduled, the nightly refresh adds the rest
+SCHEDULE_AHEAD = 2 * 86400
+
+
+class Diagnostics:
+    """ Rolling timings and health information of a SensorTide app.
+
+    Keeps the last samples of every stage (e.g. fetch, parse, set_state)
+    for percentiles and a latency histogram, plus counters, the last error
+    and the stations whose last update failed. Only used when the
+    diagnostics parameter is set.
+
+    Parameters
+    ----------
+    size: int
+        Number of samples kept per stage
+    """
+    BUCKETS = (10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self, size=100):
+        self.size = size
+        self.samples = {}
+        self.counters = {}
+        self.last_error = None
+        self.last_error_time = None
+        # Error of the last update per failing station
+        self.failing = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """ Adds a timing sample to a stage.
+        """
+        with self._lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.size)
+            self.samples[stage].append(seconds * 1000)
+
+    @contextmanager
+    def timed(self, stage):
+        """ Records the time spent in a with block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def count(self, counter, value=1):
+        """ Adds to a counter (e.g. bytes downloaded).
+        """
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def error(self, message, key=None):
+        """ Remembers the last error, and that the station key is failing.
+        """
+        with self._lock:
+            self.last_error = message
+            self.last_error_time = datetime.now(timezone.utc).isoformat()
+            if key is not None:
+                self.failing[key] = message
+
+    def clear(self, key):
+        """ Marks that the last update of the station key succeeded.
+        """
+        with self._lock:
+            self.failing.pop(key, None)
+
+    def summary(self):
+        """ Returns the diagnostics as sensor attributes.
+
+        Returns:
+            dict: Per stage p50/p95/max in ms and histogram, counters and
+                  the last error
+        """
+        attributes = {}
+        with self._lock:
+            for stage, samples in self.samples.items():
+                ordered = sorted(samples)
+                histogram = {}
+                for sample in ordered:
+                    bucket = next((limit for limit in self.BUCKETS if sample < limit), None)
+                    label = "<" + str(bucket) + "ms" if bucket else ">=" + str(self.BUCKETS[-1]) + "ms"
+                    histogram[label] = histogram.get(label, 0) + 1
+                attributes[stage + "_p50_ms"] = round(ordered[len(ordered) // 2], 1)
+                attributes[stage + "_p95_ms"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1)
+                attributes[stage + "_max_ms"] = round(ordered[-1], 1)
+                attributes[stage + "_histogram"] = histogram
+            attributes.update(self.counters)
+            attributes["last_error"] = self.last_error
+            attributes["last_error_time"] = self.last_error_time
+            attributes["failing"] = sorted(self.failing)
+        return attributes
+
+
+class TideTableParser(HTMLParser):
+    """ Streaming extractor for the BOM tide table.
+
+    Picks the localtime and height cells out of the print page while it is
+    fed, without building a document tree. The result is the same list of
+    [time, type, height] entries the sensor has always used.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tides = []
+        self._height = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('td', 'tr'):
+            self._close_height()
+        if tag != 'td':
+            return
+        attrs = dict(attrs)
+        att = (attrs.get('class') or '').split()
+        if len(att) != 2:
+            return
+        if att[0] == 'localtime':
+            self.tides.append([attrs.get('data-time-local'), att[1]])
+        elif att[0] == 'height' and self.tides:
+            self._height = []
+
+    def handle_data(self, data):
+        if self._height is not None:
+            self._height.append(data)
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'tr', 'table'):
+            self._close_height()
+
+    def close(self):
+        super().close()
+        self._close_height()
+
+    def _close_height(self):
+        if self._height is not None:
+            self.tides[-1].append(float(''.join(self._height).replace(' m', '')))
+            self._height = None
+
+
+def parse_tide_table(chunks):
+    """ Parses a BOM print page in a single pass.
+
+    Parameters:
+        chunks (iterable): Page content as str chunks
+
+    Returns:
+        tides (list): List of tide information
+    """
+    parser = TideTableParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+    return parser.tides
+
+
+class TideTable:
+    """ Sorted, array-backed table of tide events.
+
+    Times are parsed once when the table is built and kept as UTC epoch
+    seconds next to the UTC offset of the local time, the event type code and
+    the height, so lookups are a binary search over the epochs. Tables are
+    treated as immutable, merge and evict return new tables.
+    """
+    __slots__ = ('epochs', 'offsets', 'kinds', 'heights')
+    TYPES = ('low-tide', 'high-tide')
+
+    def __init__(self):
+        self.epochs = array('q')
+        self.offsets = array('h')
+        self.kinds = array('b')
+        self.heights = array('d')
+
+    @classmethod
+    def from_entries(cls, tides):
+        """ Builds a table from [time, type, height] entries.
+
+        Parameters:
+            tides (list): List of tide information
+
+        Returns:
+            TideTable: Table sorted by time
+        """
+        events = []
+        for entry in tides:
+            if entry[1] not in cls.TYPES or len(entry) < 3:
+                continue
+            moment = datetime.strptime(entry[0], '%Y-%m-%dT%H:%M:%S%z')
+            events.append((int(moment.timestamp()),
+                           int(moment.utcoffset().total_seconds() // 60),
+                           cls.TYPES.index(entry[1]), entry[2]))
+        return cls.from_events(events)
+
+    @classmethod
+    def from_events(cls, events):
+        """ Builds a table from (epoch, offset, type code, height) tuples.
+
+        Parameters:
+            events (iterable): Tide events, duplicate epochs keep the last one
+
+        Returns:
+            TideTable: Table sorted by time
+        """
+        table = cls()
+        for epoch, offset, kind, height in sorted(dict(
+                (event[0], event) for event in events).values()):
+            table.epochs.append(epoch)
+            table.offsets.append(offset)
+            table.kinds.append(kind)
+            table.heights.append(height)
+        return table
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def events(self):
+        """ Returns the events as (epoch, offset, type code, height) tuples.
+        """
+        return zip(self.epochs, self.offsets, self.kinds, self.heights)
+
+    def time(self, index):
+        """ Returns the local time of an event in ISO format.
+        """
+        local = timezone(timedelta(minutes=self.offsets[index]))
+        return datetime.fromtimestamp(self.epochs[index], local).isoformat()
+
+    def kind(self, index):
+        """ Returns the type (high-tide/low-tide) of an event.
+        """
+        return self.TYPES[self.kinds[index]]
+
+    def next_index(self, epoch):
+        """ Returns the index of the first event after epoch.
+
+        Equals len(table) if there is no later event.
+        """
+        return bisect_right(self.epochs, epoch)
+
+    def segment(self, index):
+        """ Returns the half tide cycle leading up to an event.
+
+        Before the first and after the last event the neighbouring half
+        cycle is mirrored, so the curve is defined at startup too.
+
+        Parameters:
+            index (int): Index of the event ending the half cycle (0..len)
+
+        Returns:
+            tuple: Start epoch, start height, end epoch, end height
+        """
+        epochs, heights = self.epochs, self.heights
+        if index <= 0:
+            return (2 * epochs[0] - epochs[1], heights[1], epochs[0], heights[0])
+        if index >= len(epochs):
+            return (epochs[-1], heights[-1], 2 * epochs[-1] - epochs[-2], heights[-2])
+        return (epochs[index - 1], heights[index - 1], epochs[index], heights[index])
+
+    def slope_at(self, epoch):
+        """ Returns the rate of change of the tide level.
+
+        Parameters:
+            epoch (float): Time in epoch seconds
+
+        Returns:
+            float: Change of the tide level in m per second
+        """
+        if len(self) < 2:
+            return 0
+        start, low, end, high = self.segment(self.next_index(epoch))
+        progress = (epoch - start) / (end - start)
+        if not 0 <= progress <= 1:
+            return 0
+        return (high - low) * math.pi * math.sin(math.pi * progress) / (2 * (end - start))
+
+    def height_at(self, epoch):
+        """ Returns the tide level at a point in time.
+
+        Uses the cosine (rule of twelfths) curve between the surrounding
+        high and low tide.
+
+        Parameters:
+            epoch (float): Time in epoch seconds
+
+        Returns:
+            float: Tide level in m
+
+        Raises:
+            ValueError: The table holds no tide events
+        """
+        if len(self) == 0:
+            raise ValueError("No tide information")
+        if len(self) < 2:
+            return self.heights[0]
+        start, low, end, high = self.segment(self.next_index(epoch))
+        progress = min(max((epoch - start) / (end - start), 0), 1)
+        return low + (high - low) * (1 - math.cos(math.pi * progress)) / 2
+
+    def curve(self, epochs):
+        """ Returns the tide level for a series of points in time.
+
+        The whole series is evaluated in one vectorized call when NumPy is
+        installed.
+
+        Parameters:
+            epochs (sequence): Times in epoch seconds
+
+        Returns:
+            sequence: Tide levels in m (numpy array if NumPy is installed),
+                      empty if the table holds no tide events
+        """
+        if len(self) == 0:
+            return np.empty(0) if np is not None else []
+        if np is None or len(self) < 2:
+            return [self.height_at(epoch) for epoch in epochs]
+        times = np.asarray(epochs, dtype=float)
+        known = np.frombuffer(self.epochs, dtype=np.int64).astype(float)
+        levels = np.frombuffer(self.heights, dtype=float)
+        known = np.concatenate(([2 * known[0] - known[1]], known,
+                                [2 * known[-1] - known[-2]]))
+        levels = np.concatenate(([levels[1]], levels, [levels[-2]]))
+        index = np.clip(np.searchsorted(known, times, side='right'), 1, len(known) - 1)
+        start, end = known[index - 1], known[index]
+        progress = np.clip((times - start) / (end - start), 0, 1)
+        return levels[index - 1] + (levels[index] - levels[index - 1]) * \
+            (1 - np.cos(np.pi * progress)) / 2
+
+    def curve_range(self, start, end, step=60):
+        """ Returns the tide curve between two points in time.
+
+        Parameters:
+            start (float): First time in epoch seconds
+            end (float): Last time in epoch seconds (excluded)
+            step (int): Resolution in seconds
+
+        Returns:
+            sequence: Times in epoch seconds
+            sequence: Tide levels in m
+
+            Both are empty if the table holds no tide events.
+        """
+        if len(self) == 0:
+            start = end
+        if np is not None:
+            epochs = np.arange(start, end, step, dtype=float)
+        else:
+            epochs = [start + step * index
+                      for index in range(max(0, math.ceil((end - start) / step)))]
+        return epochs, self.curve(epochs)
+
+    def crossings(self, level):
+        """ Returns the times the tide curve crosses a level.
+
+        Solves the cosine curve of every half cycle for the level, so the
+        times are exact rather than sampled.
+
+        Parameters:
+            level (float): Tide level in m
+
+        Returns:
+            list: Tuples of epoch seconds and direction (rising/falling)
+        """
+        found = []
+        for index in range(1, len(self)):
+            start, low, end, high = self.segment(index)
+            if min(low, high) < level < max(low, high):
+                progress = math.acos(1 - 2 * (level - low) / (high - low)) / math.pi
+                found.append((start + progress * (end - start),
+                              'rising' if high > low else 'falling'))
+        return found
+
+    def day_numbers(self):
+        """ Returns the local day (days since 1970-01-01) of every event.
+        """
+        return [(epoch + offset * 60) // 86400
+                for epoch, offset in zip(self.epochs, self.offsets)]
+
+    def days(self):
+        """ Returns the set of local days holding events.
+        """
+        return set(date.fromordinal(EPOCH_ORDINAL + day) for day in self.day_numbers())
+
+    def merge(self, other):
+        """ Returns a table holding the events of both, other wins on ties.
+        """
+        return TideTable.from_events(list(self.events()) + list(other.events()))
+
+    def evict(self, first):
+        """ Returns a table without the events before a local day.
+
+        Parameters:
+            first (date): First day to keep
+        """
+        first = first.toordinal() - EPOCH_ORDINAL
+        index = 0
+        for index, day in enumerate(self.day_numbers()):
+            if day >= first:
+                break
+        else:
+            index = len(self)
+        table = TideTable()
+        table.epochs = self.epochs[index:]
+        table.offsets = self.offsets[index:]
+        table.kinds = self.kinds[index:]
+        table.heights = self.heights[index:]
+        return table
+
+
+# Ordinal of the first day of the unix epoch
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class TideStore:
+    """ On-disk store of tide events, one fixed-record file per station.
+
+    Each event is packed into 13 bytes (UTC epoch, UTC offset in minutes,
+    type code, height in cm) so a station file can be memory-mapped and
+    read back instantly when AppDaemon restarts. The time of the last
+    successful fetch is kept in a small .fetched file next to it, saves
+    that only drop expired events leave it alone.
+
+    Parameters
+    ----------
+    path: str
+        Directory holding the station files
+    """
+    RECORD = struct.Struct('<qhbh')
+
+    def __init__(self, path):
+        self.path = path
+
+    def file_name(self, location, tz):
+        """ Returns the file used for a station and time zone.
+        """
+        return os.path.join(self.path, location + '_' +
+                            tz.replace('/', '_') + '.tides')
+
+    def fetched(self, location, tz):
+        """ Returns when the events of a station were last fetched from BOM.
+
+        Returns:
+            float: Epoch seconds, None if unknown
+        """
+        name = os.path.splitext(self.file_name(location, tz))[0] + '.fetched'
+        try:
+            with open(name) as file:
+                return float(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def load(self, location, tz):
+        """ Reads the stored events of a station.
+
+        Parameters:
+            location (str): Station id
+            tz (str): Time zone of the tide times
+
+        Returns:
+            TideTable: Stored tide information
+        """
+        events = []
+        try:
+            with open(self.file_name(location, tz), 'rb') as file:
+                if os.fstat(file.fileno()).st_size < self.RECORD.size:
+                    return TideTable()
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    end = len(data) - len(data) % self.RECORD.size
+                    for epoch, offset, kind, height in self.RECORD.iter_unpack(data[:end]):
+                        if 0 <= kind < len(TideTable.TYPES):
+                            events.append((epoch, offset, kind, height / 100))
+        except FileNotFoundError:
+            pass
+        return TideTable.from_events(events)
+
+    def save(self, location, tz, tides, fetched=None):
+        """ Replaces the stored events of a station.
+
+        Parameters:
+            location (str): Station id
+            tz (str): Time zone of the tide times
+            tides (TideTable): Tide information
+            fetched (float): Time new events were fetched from BOM (optional)
+        """
+        records = bytearray()
+        for epoch, offset, kind, height in tides.events():
+            records += self.RECORD.pack(epoch, offset, kind, round(height * 100))
+        os.makedirs(self.path, exist_ok=True)
+        name = self.file_name(location, tz)
+        self._replace(name, records)
+        if fetched is not None:
+            self._replace(os.path.splitext(name)[0] + '.fetched', repr(fetched).encode())
+
+    def _replace(self, name, data):
+        # Write a temporary file of our own first, so concurrent writers of
+        # the same station don't clash and readers never see a partial file
+        handle, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, name)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+class BomServerError(Exception):
+    """ BOM answered with a server error, the request can be retried.
+    """
+
+
+class BomClient:
+    """ HTTP client for the BOM tide print pages.
+
+    Keeps a pool of keep-alive connections, uses explicit connect/read
+    timeouts and retries connection errors, timeouts and server errors with
+    jittered exponential backoff. Pages are requested gzip compressed and
+    revalidated with If-None-Match / If-Modified-Since when BOM provided an
+    ETag or Last-Modified header, a 304 reuses the previously parsed table.
+
+    Parameters
+    ----------
+    pool_size: int
+        Number of pooled connections
+    connect_timeout: float
+        Seconds to wait for a connection
+    read_timeout: float
+        Seconds to wait for data
+    retries: int
+        Number of retries after a failed request
+    backoff: float
+        Base delay between retries in seconds
+    diagnostics: Diagnostics
+        Receives fetch/parse timings, bytes and errors (optional)
+    """
+    def __init__(self, pool_size=4, connect_timeout=5, read_timeout=20,
+                 retries=3, backoff=1.0, diagnostics=None):
+        self.diagnostics = diagnostics
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests = 0
+        self.failures = 0
+        self.retried = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.latency = deque(maxlen=100)
+        self._validators = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_tides(self, url):
+        """ Downloads and parses a BOM tide table.
+
+        Parameters:
+            url (str): BOM print page
+
+        Returns:
+            tides (TideTable): Tide information
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._get_tides(url)
+            except (requests.ConnectionError, requests.Timeout, BomServerError):
+                if attempt == self.retries:
+                    raise
+                with self._lock:
+                    self.retried += 1
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def _get_tides(self, url):
+        with self._lock:
+            known = self._validators.get(url)
+        headers = {}
+        if known is not None:
+            if known[0]:
+                headers["If-None-Match"] = known[0]
+            if known[1]:
+                headers["If-Modified-Since"] = known[1]
+        start = time.perf_counter()
+        size = 0
+        parse_time = 0
+        try:
+            with self.session.get(url, headers=headers, stream=True,
+                                  timeout=self.timeout) as response:
+                if response.status_code == 304 and known is not None:
+                    tides = known[2]
+                elif response.status_code >= 500 or response.status_code == 429:
+                    raise BomServerError(str(response.status_code) + " from " + url)
+                else:
+                    response.raise_for_status()
+                    if response.encoding is None:
+                        response.encoding = 'utf-8'
+                    # Stream the page straight into the parser, the CPU time
+                    # of this thread excludes waiting for the network
+                    cpu = time.thread_time()
+                    entries = parse_tide_table(
+                        response.iter_content(chunk_size=8192, decode_unicode=True))
+                    if len(entries) == 0:
+                        raise ValueError("No tide information found")
+                    tides = TideTable.from_entries(entries)
+                    parse_time = time.thread_time() - cpu
+                    self._remember(url, response.headers, tides)
+                size = response.raw.tell()
+        except Exception:
+            with self._lock:
+                self.requests += 1
+                self.failures += 1
+            if self.diagnostics is not None:
+                self.diagnostics.count("fetch_failures")
+            raise
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.not_modified += response.status_code == 304
+            self.latency.append(latency)
+        if self.diagnostics is not None:
+            self.diagnostics.record("fetch", latency)
+            self.diagnostics.count("bytes_downloaded", size)
+            if parse_time:
+                self.diagnostics.record("parse", parse_time)
+        return tides
+
+    def _remember(self, url, headers, tides):
+        etag = headers.get("ETag")
+        modified = headers.get("Last-Modified")
+        if not etag and not modified:
+            return
+        with self._lock:
+            self._validators[url] = (etag, modified, tides)
+            self._validators.move_to_end(url)
+            while len(self._validators) > 64:
+                self._validators.popitem(last=False)
+
+    def stats(self):
+        """ Returns the request counters and latencies.
+
+        Returns:
+            dict: Requests, failures, retries, 304 responses, bytes
+                  downloaded and the median/max latency in ms
+        """
+        with self._lock:
+            latency = sorted(self.latency)
+            return {"requests": self.requests, "failures": self.failures,
+                    "retries": self.retried, "not_modified": self.not_modified,
+                    "bytes": self.bytes,
+                    "latency_p50": round(latency[len(latency) // 2] * 1000) if latency else None,
+                    "latency_max": round(latency[-1] * 1000) if latency else None}
+
+    def close(self):
+        self.session.close()
+
+
+def haversine_many(lat, long, lats, longs):
+    """ Calculates the distance from one coordinate to many.
+
+    Vectorized with NumPy when it is installed.
+
+    Parameters:
+        lat (float): Latitude of the base point
+        long (float): Longitude of the base point
+        lats (sequence): Latitudes
+        longs (sequence): Longitudes
+
+    Returns:
+        list: Distances in km (rounded to 100m)
+    """
+    R = 6372.8  # Earth radius in km
+    if np is not None:
+        phi1, phi2 = np.radians(lat), np.radians(np.asarray(lats, dtype=float))
+        dphi = phi2 - phi1
+        dlambda = np.radians(np.asarray(longs, dtype=float) - long)
+        a = np.sin(dphi/2)**2 + np.cos(phi1)*np.cos(phi2)*np.sin(dlambda/2)**2
+        return np.round(2*R*np.arctan2(np.sqrt(a), np.sqrt(1 - a)), 1).tolist()
+    distances = []
+    phi1 = math.radians(lat)
+    for lat2, long2 in zip(lats, longs):
+        phi2 = math.radians(lat2)
+        dphi = phi2 - phi1
+        dlambda = math.radians(long2 - long)
+        a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
+        distances.append(round(2*R*math.atan2(math.sqrt(a), math.sqrt(1 - a)), 1))
+    return distances
+
+
+# Suported locations with coordinates and name (aac, lat, long, name)
+LOCATIONS = (
+    ('NSW_TP001', -33.9666666666667, 151.216666666667, 'Botany Bay'),
+    ('NSW_TP002', -37.0666666666667, 149.9, 'Eden'),
+    ('NSW_TP003', -31.5166666666667, 159.05, 'Lord Howe Island'),
+    ('NSW_TP004', -32.9166666666667, 151.783333333333, 'Newcastle'),
+    ('NSW_TP005', -29.0666666666667, 167.95, 'Norfolk Island'),
+    ('NSW_TP006', -34.4833333333333, 150.916666666667, 'Port Kembla'),
+    ('NSW_TP007', -33.85, 151.233333333333, 'Sydney (Fort Denison)'),
+    ('NSW_TP008', -29.4333333333333, 153.366666666667, 'Yamba'),
+    ('NT_TP001', -12.4666666666667, 130.85, 'Darwin'),
+    ('NT_TP002', -12.2, 136.666666666667, 'Melville Bay (Gove Harbour)'),
+    ('NT_TP003', -13.8666666666667, 136.416666666667, 'Milner Bay (Groote Eylandt)'),
+    ('NT_TP014', -15.75, 136.816666666667, 'Centre Island'),
+    ('NT_TP036', -12.3333333333333, 130.7, 'Charles Point Patches'),
+    ('QLD_TP001', -19.85, 148.116666666667, 'Abbot Point'),
+    ('QLD_TP002', -20.0166666666667, 148.25, 'Bowen'),
+    ('QLD_TP003', -27.3666666666667, 153.166666666667, 'Brisbane Bar'),
+    ('QLD_TP004', -20.0833333333333, 150.3, 'Bugatti Reef'),
+    ('QLD_TP005', -24.7666666666667, 152.383333333333, 'Bundaberg (Burnett Heads)'),
+    ('QLD_TP006', -16.9333333333333, 145.783333333333, 'Cairns'),
+    ('QLD_TP008', -23.8333333333333, 151.25, 'Gladstone'),
+    ('QLD_TP009', -27.9666666666667, 153.416666666667, 'Gold Coast Operations Base'),
+    ('QLD_TP011', -27.95, 153.416666666667, 'Gold Coast Seaway'),
+    ('QLD_TP012', -21.2666666666667, 149.3, 'Hay Point'),
+    ('QLD_TP013', -17.5, 140.833333333333, 'Karumba'),
+    ('QLD_TP014', -14.5333333333333, 144.85, 'Leggatt Island'),
+    ('QLD_TP017', -18.5166666666667, 146.383333333333, 'Lucinda (Offshore)'),
+    ('QLD_TP018', -21.1166666666667, 149.233333333333, 'Mackay Outer Harbour'),
+    ('QLD_TP019', -26.6833333333333, 153.116666666667, 'Mooloolaba'),
+    ('QLD_TP020', -17.6, 146.116666666667, 'Mourilyan Harbour'),
+    ('QLD_TP021', -26.3833333333333, 153.1, 'Noosa Head'),
+    ('QLD_TP022', -23.5833333333333, 150.866666666667, 'Port Alma'),
+    ('QLD_TP023', -16.4833333333333, 145.466666666667, 'Port Douglas'),
+    ('QLD_TP024', -23.1666666666667, 150.8, 'Rosslyn Bay'),
+    ('QLD_TP025', -20.2833333333333, 148.783333333333, 'Shute Harbour'),
+    ('QLD_TP026', -10.6, 141.916666666667, 'Booby Island'),
+    ('QLD_TP027', -10.5666666666667, 142.15, 'Goods Island'),
+    ('QLD_TP030', -10.5833333333333, 142.216666666667, 'Thursday Island'),
+    ('QLD_TP032', -10.45, 142.45, 'Twin Island'),
+    ('QLD_TP033', -19.25, 146.833333333333, 'Townsville'),
+    ('QLD_TP034', -25.3, 152.9, 'Urangan'),
+    ('QLD_TP035', -24.9666666666667, 153.35, 'Waddy Point (Fraser Island)'),
+    ('QLD_TP036', -12.6666666666667, 141.866666666667, 'Weipa (Humbug Point)'),
+    ('QLD_TP104', -27.35, 153.1, 'Serpentine Creek'),
+    ('QLD_TP135', -18.25, 146.033333333333, 'Cardwell'),
+    ('QLD_TP138', -27.4666666666667, 153.033333333333, 'Brisbane Port Office'),
+    ('QLD_TP147', -27.0833333333333, 153.15, 'Bribie I., Bongaree'),
+    ('QLD_TP148', -27.0833333333333, 153.3, 'Bn M2, Moreton Bay'),
+    ('QLD_TP149', -27.1833333333333, 153.366666666667, 'Tangalooma Point'),
+    ('SA_TP001', -34.7833333333333, 138.483333333333, 'Port Adelaide (Outer Harbor)'),
+    ('SA_TP002', -35.0166666666667, 137.766666666667, 'Port Giles'),
+    ('SA_TP003', -34.7166666666667, 135.866666666667, 'Port Lincoln'),
+    ('SA_TP004', -33.1833333333333, 138.016666666667, 'Port Pirie'),
+    ('SA_TP005', -32.15, 133.633333333333, 'Thevenard'),
+    ('SA_TP006', -35.5666666666667, 138.633333333333, 'Victor Harbor'),
+    ('SA_TP007', -33.9333333333333, 137.616666666667, 'Wallaroo'),
+    ('SA_TP008', -33.0166666666667, 137.583333333333, 'Whyalla'),
+    ('TAS_TP001', -41.05, 145.916666666667, 'Burnie'),
+    ('TAS_TP003', -42.8833333333333, 147.333333333333, 'Hobart'),
+    ('TAS_TP004', -41.0666666666667, 146.8, 'Low Head'),
+    ('TAS_TP005', -41.15, 146.383333333333, 'Devonport'),
+    ('TAS_TP007', -42.55, 147.933333333333, 'Spring Bay'),
+    ('TAS_TP008', -40.7666666666667, 145.3, 'Stanley'),
+    ('VIC_TP001', -37.8833333333333, 147.966666666667, 'Lakes Entrance (Outer)'),
+    ('VIC_TP002', -38.55, 143.983333333333, 'Lorne'),
+    ('VIC_TP003', -37.8666666666667, 144.916666666667, 'Melbourne (Williamstown)'),
+    ('VIC_TP004', -38.1, 144.65, 'Corio Bay'),
+    ('VIC_TP005', -38.15, 144.366666666667, 'Geelong'),
+    ('VIC_TP006', -38.3333333333333, 144.9, 'Hovell Pile'),
+    ('VIC_TP007', -38.2666666666667, 144.666666666667, 'Queenscliff'),
+    ('VIC_TP008', -38.2, 144.75, 'West Channel Pile'),
+    ('VIC_TP009', -38.3, 144.616666666667, 'Point Lonsdale'),
+    ('VIC_TP010', -38.7, 146.466666666667, 'Port Welshpool Pier'),
+    ('VIC_TP011', -38.35, 141.616666666667, 'Portland'),
+    ('VIC_TP012', -38.9166666666667, 146.516666666667, 'Rabbit Island'),
+    ('VIC_TP013', -38.3666666666667, 145.216666666667, 'Western Port (Stony Point)'),
+    ('WA_TP001', -35.0333333333333, 117.9, 'Albany'),
+    ('WA_TP002', -20.8166666666667, 115.55, 'Barrow Island (Tanker Mooring)'),
+    ('WA_TP003', -20.7333333333333, 115.466666666667, 'Barrow Island (Wapet Landing)'),
+    ('WA_TP004', -18, 122.216666666667, 'Broome'),
+    ('WA_TP005', -33.3166666666667, 115.666666666667, 'Bunbury'),
+    ('WA_TP007', -14.25, 125.6, 'Cape Voltaire (Krait Bay)'),
+    ('WA_TP008', -24.9, 113.65, 'Carnarvon'),
+    ('WA_TP009', -10.4333333333333, 105.666666666667, 'Christmas Island'),
+    ('WA_TP011', -20.6166666666667, 116.75, 'Dampier (King Bay)'),
+    ('WA_TP012', -25.9333333333333, 113.533333333333, 'Denham'),
+    ('WA_TP013', -33.8666666666667, 121.9, 'Esperance'),
+    ('WA_TP014', -21.95, 114.133333333333, 'Exmouth'),
+    ('WA_TP015', -32.05, 115.733333333333, 'Fremantle'),
+    ('WA_TP016', -28.7833333333333, 114.6, 'Geraldton'),
+    ('WA_TP018', -21.65, 115.133333333333, 'Onslow (Beadon Creek)'),
+    ('WA_TP020', -20.3166666666667, 118.566666666667, 'Port Hedland'),
+    ('WA_TP021', -20.5833333333333, 117.183333333333, 'Port Walcott (Cape Lambert)'),
+    ('WA_TP022', -21.4666666666667, 115.016666666667, 'Thevenard Island'),
+    ('WA_TP023', -15.45, 128.1, 'Wyndham'),
+    ('WA_TP024', -16.1333333333333, 123.733333333333, 'Yampi Sound (Koolan Island)'),
+    ('WA_TP025', -21.65, 115.016666666667, 'Ashburton North'),
+    ('WA_TP032', -14.8333333333333, 128.3, 'Cape Domett'),
+    ('WA_TP043', -17.3, 123.6, 'Derby'),
+)
+
+
+class StationCatalogue:
+    """ Tide stations with a lat/long grid index.
+
+    Stations are bucketed into one degree cells. Radius queries only
+    measure the stations in the cells overlapping the search box, nearest-N
+    queries widen the radius until enough stations are found.
+
+    The catalogue is immutable and shared by all SensorTide instances, see
+    station_catalogue. Its attributes can't be set after __init__ and the
+    lookups are read-only mappings of tuples.
+
+    Parameters
+    ----------
+    stations: iterable
+        Station records
+    """
+    __slots__ = ('stations', 'ids', 'lats', 'longs', 'cells')
+    CELL = 1.0
+    KM_PER_DEGREE = 111.2
+
+    def __init__(self, stations):
+        by_id = {station.aac: station for station in stations}
+        ids = tuple(by_id)
+        lats = tuple(by_id[aac].lat for aac in ids)
+        longs = tuple(by_id[aac].long for aac in ids)
+        cells = {}
+        for index, (lat, long) in enumerate(zip(lats, longs)):
+            cells.setdefault(self.cell(lat, long), []).append(index)
+        object.__setattr__(self, 'stations', MappingProxyType(by_id))
+        object.__setattr__(self, 'ids', ids)
+        object.__setattr__(self, 'lats', lats)
+        object.__setattr__(self, 'longs', longs)
+        object.__setattr__(self, 'cells', MappingProxyType(
+            {cell: tuple(indexes) for cell, indexes in cells.items()}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StationCatalogue is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("StationCatalogue is immutable")
+
+    def __contains__(self, aac):
+        return aac in self.stations
+
+    def __len__(self):
+        return len(self.ids)
+
+    def cell(self, lat, long):
+        return (math.floor(lat / self.CELL), math.floor(long / self.CELL) % round(360 / self.CELL))
+
+    def name(self, aac):
+        """ Returns the name of a station.
+        """
+        return self.stations[aac].name
+
+    def distance(self, aac, lat, long):
+        """ Returns the distance from a coordinate to a station in km.
+        """
+        station = self.stations[aac]
+        return haversine_many(lat, long, [station.lat], [station.long])[0]
+
+    def candidates(self, lat, long, radius):
+        """ Returns the stations in the grid cells around a coordinate.
+
+        Parameters:
+            lat (float): Latitude
+            long (float): Longitude
+            radius (float): Radius in km
+
+        Returns:
+            list: Station indexes, None if the box covers more cells than
+                  hold stations (a pass over all stations is cheaper)
+        """
+        dlat = radius / self.KM_PER_DEGREE
+        rows = range(math.floor(max(lat - dlat, -90) / self.CELL),
+                     math.floor(min(lat + dlat, 90) / self.CELL) + 1)
+        coslat = math.cos(math.radians(min(abs(lat) + dlat, 90)))
+        columns = round(360 / self.CELL)
+        if coslat < 1e-6 or radius / (self.KM_PER_DEGREE * coslat) >= 180:
+            cols = range(columns)
+        else:
+            dlong = radius / (self.KM_PER_DEGREE * coslat)
+            cols = sorted(set(col % columns for col in range(
+                math.floor((long - dlong) / self.CELL), math.floor((long + dlong) / self.CELL) + 1)))
+        if len(rows) * len(cols) > len(self.cells):
+            return None
+        candidates = []
+        for row in rows:
+            for col in cols:
+                candidates.extend(self.cells.get((row, col), ()))
+        return candidates
+
+    def within(self, lat, long, radius):
+        """ Returns the stations within a radius of a coordinate.
+
+        Parameters:
+            lat (float): Latitude
+            long (float): Longitude
+            radius (float): Radius in km
+
+        Returns:
+            list: Tuples of station id and distance in km, closest first
+        """
+        candidates = self.candidates(lat, long, radius)
+        if candidates is None:
+            candidates = range(len(self.ids))
+            distances = haversine_many(lat, long, self.lats, self.longs)
+        else:
+            distances = haversine_many(lat, long, [self.lats[index] for index in candidates],
+                                       [self.longs[index] for index in candidates])
+        found = [(self.ids[index], distance) for index, distance in zip(candidates, distances)
+                 if distance <= radius]
+        found.sort(key=lambda entry: entry[1])
+        return found
+
+    def nearest(self, lat, long, count=1):
+        """ Returns the stations closest to a coordinate.
+
+        Parameters:
+            lat (float): Latitude
+            long (float): Longitude
+            count (int): Number of stations
+
+        Returns:
+            list: Tuples of station id and distance in km, closest first
+        """
+        radius = 50
+        while self.candidates(lat, long, radius) is not None:
+            found = self.within(lat, long, radius)
+            # Anything outside the radius is further away than all found
+            if len(found) >= min(count, len(self)):
+                return found[:count]
+            radius *= 2
+        # The box covers every station, one pass over all of them
+        return self.within(lat, long, math.inf)[:count]
+
+
+Station = namedtuple('Station', 'aac lat long name')
+
+_CATALOGUES = {}
+_CATALOGUE_LOCK = threading.Lock()
+
+
+def station_catalogue(station_file=None):
+    """ Returns the shared station catalogue.
+
+    The catalogue is built on first use and then shared by all SensorTide
+    instances of the process.
+
+    Parameters:
+        station_file (str): CSV file (aac,lat,long,name) with additional stations
+
+    Returns:
+        StationCatalogue: Supported stations
+    """
+    with _CATALOGUE_LOCK:
+        catalogue = _CATALOGUES.get(station_file)
+        if catalogue is None:
+            stations = [Station(*location) for location in LOCATIONS]
+            if station_file is not None:
+                # Additional stations, e.g. the full BOM station list
+                with open(station_file, newline='') as file:
+                    for row in csv.DictReader(file):
+                        stations.append(Station(row['aac'], float(row['lat']),
+                                                float(row['long']), row['name'].strip()))
+            catalogue = _CATALOGUES[station_file] = StationCatalogue(stations)
+        return catalogue
+
+
+class TideStation:
+    """ One tide sensor served by a SensorTide app.
+
+    Holds the per sensor state, so a single app instance can serve any
+    number of stations.
+
+    Parameters
+    ----------
+    args: dict
+        Sensor configuration (actuator, friendly_name, tide_thresholds, ...)
+    location: str
+        Station id
+    distance: float
+        Distance to the station in km
+    """
+    def __init__(self, args, location, distance=None):
+        self.args = args
+        self.actuator = args["actuator"]
+        self.location = location
+        self.distance = distance
+        self.tides = TideTable()
+        # Time the held tides were fetched (epoch seconds)
+        self.updated = None
+        self.published = None
+        self.published_at = None
+        # Time the sensor needs its next update (epoch seconds)
+        self.due = 0
+        # Event driven triggers, rescheduled whenever the tides change
+        self.listeners = []
+        self.timers = []
+        self.index = []
+
+        # Setup the default state and attributes
+        self.attribute = {}
+        self.attribute.update({"unit_of_measurement": "m"})
+        if "friendly_name" in args:
+            self.attribute.update({"friendly_name":
+                                  args["friendly_name"]})
+        self.attribute.update({"icon": "mdi:waves"})
+        # Set specific attribute
+        self.attribute.update({"Next tide": ""})
+        self.attribute.update({"Next height": 0})
+        self.attribute.update({"Tide time": ""})
+        self.attribute.update({"Time in min": 0})
+        self.attribute.update({"degree": 0})
+        self.attribute.update({"location": ""})
+
 
 class SensorTide(hass.Hass):
     """ Sensor to pull tidal information from BOM (Australia).
@@ -12,8 +1133,6 @@ class SensorTide(hass.Hass):
     This sensor pulls the tidal information from BOM (Australia), cleans the data and 
     calculates current tide level and time to next event.
 
-    The sensor requires the BeautifulSoup lib (pip install bs4) !
-
     Pick a location from the list below. If no location is provided, the closest 
     location will be determined from the Appdaemon long and lat values.
 
@@ -50,166 +1169,245 @@ class SensorTide(hass.Hass):
         Sensor source station
     friendly_name: str (optional)
         Friendly name for the sensor
+    tide_store: str (optional)
+        Directory for the local copy of the tide tables
+    tide_horizon: int (optional)
+        Number of days ahead of today to keep (default 1)
+    tide_thresholds: list (optional)
+        Tide levels in m, a tide_threshold event is fired when crossed
+    tide_offsets: dict (optional)
+        Minutes relative to tide events (e.g. low-tide: [-120]), a
+        tide_event event is fired at these times
+    min_interval: int (optional)
+        Shortest time between sensor updates in seconds (default 60)
+    max_interval: int (optional)
+        Longest time between sensor updates in seconds (default 900)
+    state_resolution: float (optional)
+        Change of the tide level in m that triggers a sensor update
+        (default 0.05)
+    stations: list (optional)
+        Several sensors served by one app, each entry takes actuator,
+        tide_location, friendly_name and the trigger parameters
+    max_connections: int (optional)
+        Number of stations fetched from BOM at the same time (default 4)
+    http_timeout: int (optional)
+        Seconds to wait for BOM to answer (default 20)
+    http_retries: int (optional)
+        Number of retries of a failed BOM request (default 3)
+    station_file: str (optional)
+        CSV file (aac,lat,long,name) with additional BOM stations
+    diagnostics: bool or str (optional)
+        Publish timings and health to a diagnostics sensor, either
+        sensor.<app name>_diagnostics or the given entity
     """
     def initialize(self):
-        # List of suported locations with coordinates and name
-        self.location_list = {
-            'NSW_TP001': { 'lat': -33.9666666666667, 'long': 151.216666666667, 'name': ' Botany Bay' },
-            'NSW_TP002': { 'lat': -37.0666666666667, 'long': 149.9, 'name': ' Eden' },
-            'NSW_TP003': { 'lat': -31.5166666666667, 'long': 159.05, 'name': ' Lord Howe Island' },
-            'NSW_TP004': { 'lat': -32.9166666666667, 'long': 151.783333333333, 'name': ' Newcastle' },
-            'NSW_TP005': { 'lat': -29.0666666666667, 'long': 167.95, 'name': ' Norfolk Island' },
-            'NSW_TP006': { 'lat': -34.4833333333333, 'long': 150.916666666667, 'name': ' Port Kembla' },
-            'NSW_TP007': { 'lat': -33.85, 'long': 151.233333333333, 'name': ' Sydney (Fort Denison)' },
-            'NSW_TP008': { 'lat': -29.4333333333333, 'long': 153.366666666667, 'name': ' Yamba' },
-            'NT_TP001': { 'lat': -12.4666666666667, 'long': 130.85, 'name': ' Darwin' },
-            'NT_TP002': { 'lat': -12.2, 'long': 136.666666666667, 'name': ' Melville Bay (Gove Harbour)' },
-            'NT_TP003': { 'lat': -13.8666666666667, 'long': 136.416666666667, 'name': ' Milner Bay (Groote Eylandt)' },
-            'NT_TP014': { 'lat': -15.75, 'long': 136.816666666667, 'name': ' Centre Island' },
-            'NT_TP036': { 'lat': -12.3333333333333, 'long': 130.7, 'name': ' Charles Point Patches' },
-            'QLD_TP001': { 'lat': -19.85, 'long': 148.116666666667, 'name': ' Abbot Point' },
-            'QLD_TP002': { 'lat': -20.0166666666667, 'long': 148.25, 'name': ' Bowen' },
-            'QLD_TP003': { 'lat': -27.3666666666667, 'long': 153.166666666667, 'name': ' Brisbane Bar' },
-            'QLD_TP004': { 'lat': -20.0833333333333, 'long': 150.3, 'name': ' Bugatti Reef' },
-            'QLD_TP005': { 'lat': -24.7666666666667, 'long': 152.383333333333, 'name': ' Bundaberg (Burnett Heads)' },
-            'QLD_TP006': { 'lat': -16.9333333333333, 'long': 145.783333333333, 'name': ' Cairns' },
-            'QLD_TP008': { 'lat': -23.8333333333333, 'long': 151.25, 'name': ' Gladstone' },
-            'QLD_TP009': { 'lat': -27.9666666666667, 'long': 153.416666666667, 'name': ' Gold Coast Operations Base' },
-            'QLD_TP011': { 'lat': -27.95, 'long': 153.416666666667, 'name': ' Gold Coast Seaway' },
-            'QLD_TP012': { 'lat': -21.2666666666667, 'long': 149.3, 'name': ' Hay Point' },
-            'QLD_TP013': { 'lat': -17.5, 'long': 140.833333333333, 'name': ' Karumba' },
-            'QLD_TP014': { 'lat': -14.5333333333333, 'long': 144.85, 'name': ' Leggatt Island' },
-            'QLD_TP017': { 'lat': -18.5166666666667, 'long': 146.383333333333, 'name': ' Lucinda (Offshore)' },
-            'QLD_TP018': { 'lat': -21.1166666666667, 'long': 149.233333333333, 'name': ' Mackay Outer Harbour' },
-            'QLD_TP019': { 'lat': -26.6833333333333, 'long': 153.116666666667, 'name': ' Mooloolaba' },
-            'QLD_TP020': { 'lat': -17.6, 'long': 146.116666666667, 'name': ' Mourilyan Harbour' },
-            'QLD_TP021': { 'lat': -26.3833333333333, 'long': 153.1, 'name': ' Noosa Head' },
-            'QLD_TP022': { 'lat': -23.5833333333333, 'long': 150.866666666667, 'name': ' Port Alma' },
-            'QLD_TP023': { 'lat': -16.4833333333333, 'long': 145.466666666667, 'name': ' Port Douglas' },
-            'QLD_TP024': { 'lat': -23.1666666666667, 'long': 150.8, 'name': ' Rosslyn Bay' },
-            'QLD_TP025': { 'lat': -20.2833333333333, 'long': 148.783333333333, 'name': ' Shute Harbour' },
-            'QLD_TP026': { 'lat': -10.6, 'long': 141.916666666667, 'name': ' Booby Island' },
-            'QLD_TP027': { 'lat': -10.5666666666667, 'long': 142.15, 'name': ' Goods Island' },
-            'QLD_TP030': { 'lat': -10.5833333333333, 'long': 142.216666666667, 'name': ' Thursday Island' },
-            'QLD_TP032': { 'lat': -10.45, 'long': 142.45, 'name': ' Twin Island' },
-            'QLD_TP033': { 'lat': -19.25, 'long': 146.833333333333, 'name': ' Townsville' },
-            'QLD_TP034': { 'lat': -25.3, 'long': 152.9, 'name': ' Urangan' },
-            'QLD_TP035': { 'lat': -24.9666666666667, 'long': 153.35, 'name': ' Waddy Point (Fraser Island)' },
-            'QLD_TP036': { 'lat': -12.6666666666667, 'long': 141.866666666667, 'name': ' Weipa (Humbug Point)' },
-            'QLD_TP104': { 'lat': -27.35, 'long': 153.1, 'name': ' Serpentine Creek' },
-            'QLD_TP135': { 'lat': -18.25, 'long': 146.033333333333, 'name': ' Cardwell' },
-            'QLD_TP138': { 'lat': -27.4666666666667, 'long': 153.033333333333, 'name': ' Brisbane Port Office' },
-            'QLD_TP147': { 'lat': -27.0833333333333, 'long': 153.15, 'name': ' Bribie I., Bongaree' },
-            'QLD_TP148': { 'lat': -27.0833333333333, 'long': 153.3, 'name': ' Bn M2, Moreton Bay' },
-            'QLD_TP149': { 'lat': -27.1833333333333, 'long': 153.366666666667, 'name': ' Tangalooma Point' },
-            'SA_TP001': { 'lat': -34.7833333333333, 'long': 138.483333333333, 'name': ' Port Adelaide (Outer Harbor)' },
-            'SA_TP002': { 'lat': -35.0166666666667, 'long': 137.766666666667, 'name': ' Port Giles' },
-            'SA_TP003': { 'lat': -34.7166666666667, 'long': 135.866666666667, 'name': ' Port Lincoln' },
-            'SA_TP004': { 'lat': -33.1833333333333, 'long': 138.016666666667, 'name': ' Port Pirie' },
-            'SA_TP005': { 'lat': -32.15, 'long': 133.633333333333, 'name': ' Thevenard' },
-            'SA_TP006': { 'lat': -35.5666666666667, 'long': 138.633333333333, 'name': ' Victor Harbor' },
-            'SA_TP007': { 'lat': -33.9333333333333, 'long': 137.616666666667, 'name': ' Wallaroo' },
-            'SA_TP008': { 'lat': -33.0166666666667, 'long': 137.583333333333, 'name': ' Whyalla' },
-            'TAS_TP001': { 'lat': -41.05, 'long': 145.916666666667, 'name': ' Burnie' },
-            'TAS_TP003': { 'lat': -42.8833333333333, 'long': 147.333333333333, 'name': ' Hobart' },
-            'TAS_TP004': { 'lat': -41.0666666666667, 'long': 146.8, 'name': ' Low Head' },
-            'TAS_TP005': { 'lat': -41.15, 'long': 146.383333333333, 'name': ' Devonport' },
-            'TAS_TP007': { 'lat': -42.55, 'long': 147.933333333333, 'name': ' Spring Bay' },
-            'TAS_TP008': { 'lat': -40.7666666666667, 'long': 145.3, 'name': ' Stanley' },
-            'VIC_TP001': { 'lat': -37.8833333333333, 'long': 147.966666666667, 'name': ' Lakes Entrance (Outer)' },
-            'VIC_TP002': { 'lat': -38.55, 'long': 143.983333333333, 'name': ' Lorne' },
-            'VIC_TP003': { 'lat': -37.8666666666667, 'long': 144.916666666667, 'name': ' Melbourne (Williamstown)' },
-            'VIC_TP004': { 'lat': -38.1, 'long': 144.65, 'name': ' Corio Bay' },
-            'VIC_TP005': { 'lat': -38.15, 'long': 144.366666666667, 'name': ' Geelong' },
-            'VIC_TP006': { 'lat': -38.3333333333333, 'long': 144.9, 'name': ' Hovell Pile' },
-            'VIC_TP007': { 'lat': -38.2666666666667, 'long': 144.666666666667, 'name': ' Queenscliff' },
-            'VIC_TP008': { 'lat': -38.2, 'long': 144.75, 'name': ' West Channel Pile' },
-            'VIC_TP009': { 'lat': -38.3, 'long': 144.616666666667, 'name': ' Point Lonsdale' },
-            'VIC_TP010': { 'lat': -38.7, 'long': 146.466666666667, 'name': ' Port Welshpool Pier' },
-            'VIC_TP011': { 'lat': -38.35, 'long': 141.616666666667, 'name': ' Portland' },
-            'VIC_TP012': { 'lat': -38.9166666666667, 'long': 146.516666666667, 'name': ' Rabbit Island' },
-            'VIC_TP013': { 'lat': -38.3666666666667, 'long': 145.216666666667, 'name': ' Western Port (Stony Point)' },
-            'WA_TP001': { 'lat': -35.0333333333333, 'long': 117.9, 'name': ' Albany' },
-            'WA_TP002': { 'lat': -20.8166666666667, 'long': 115.55, 'name': ' Barrow Island (Tanker Mooring)' },
-            'WA_TP003': { 'lat': -20.7333333333333, 'long': 115.466666666667, 'name': ' Barrow Island (Wapet Landing)' },
-            'WA_TP004': { 'lat': -18, 'long': 122.216666666667, 'name': ' Broome' },
-            'WA_TP005': { 'lat': -33.3166666666667, 'long': 115.666666666667, 'name': ' Bunbury' },
-            'WA_TP007': { 'lat': -14.25, 'long': 125.6, 'name': ' Cape Voltaire (Krait Bay)' },
-            'WA_TP008': { 'lat': -24.9, 'long': 113.65, 'name': ' Carnarvon' },
-            'WA_TP009': { 'lat': -10.4333333333333, 'long': 105.666666666667, 'name': ' Christmas Island' },
-            'WA_TP011': { 'lat': -20.6166666666667, 'long': 116.75, 'name': ' Dampier (King Bay)' },
-            'WA_TP012': { 'lat': -25.9333333333333, 'long': 113.533333333333, 'name': ' Denham' },
-            'WA_TP013': { 'lat': -33.8666666666667, 'long': 121.9, 'name': ' Esperance' },
-            'WA_TP014': { 'lat': -21.95, 'long': 114.133333333333, 'name': ' Exmouth' },
-            'WA_TP015': { 'lat': -32.05, 'long': 115.733333333333, 'name': ' Fremantle' },
-            'WA_TP016': { 'lat': -28.7833333333333, 'long': 114.6, 'name': ' Geraldton' },
-            'WA_TP018': { 'lat': -21.65, 'long': 115.133333333333, 'name': ' Onslow (Beadon Creek)' },
-            'WA_TP020': { 'lat': -20.3166666666667, 'long': 118.566666666667, 'name': ' Port Hedland' },
-            'WA_TP021': { 'lat': -20.5833333333333, 'long': 117.183333333333, 'name': ' Port Walcott (Cape Lambert)' },
-            'WA_TP022': { 'lat': -21.4666666666667, 'long': 115.016666666667, 'name': ' Thevenard Island' },
-            'WA_TP023': { 'lat': -15.45, 'long': 128.1, 'name': ' Wyndham' },
-            'WA_TP024': { 'lat': -16.1333333333333, 'long': 123.733333333333, 'name': ' Yampi Sound (Koolan Island)' },
-            'WA_TP025': { 'lat': -21.65, 'long': 115.016666666667, 'name': ' Ashburton North' },
-            'WA_TP032': { 'lat': -14.8333333333333, 'long': 128.3, 'name': ' Cape Domett' },
-            'WA_TP043': { 'lat': -17.3, 'long': 123.6, 'name': ' Derby' },
-        }
+        # Supported locations, shared by all instances
+        self.catalogue = station_catalogue(self.args.get("station_file"))
 
-        # Setup the default state and attributes
-        self.attribute = {}
-        self.attribute.update({"unit_of_measurement": "m"})
-        if "friendly_name" in self.args:
-            self.attribute.update({"friendly_name":
-                                  self.args["friendly_name"]})
-        self.attribute.update({"icon": "mdi:waves"})
-        # Set specific attribute
-        self.attribute.update({"Next tide": ""})
-        self.attribute.update({"Next height": 0})
-        self.attribute.update({"Tide time": ""})
-        self.attribute.update({"Time in min": 0})
-        self.attribute.update({"degree": 0})
-        self.attribute.update({"location": ""})
-        self.set_state(self.args["actuator"],
-                       attributes=self.attribute, state="Unknown")
+        config = self.get_plugin_config()
+        self.tz = config["time_zone"]
+        # Warm start from the local copy, BOM is only asked for missing days
+        self.store = TideStore(self.args.get("tide_store", os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "tide_store")))
+        self.horizon = int(self.args.get("tide_horizon", 1))
+        self.min_interval = int(self.args.get("min_interval", 60))
+        self.max_interval = int(self.args.get("max_interval", 900))
+        self.resolution = float(self.args.get("state_resolution", 0.05))
+        # Stations are fetched concurrently over one connection pool
+        max_connections = int(self.args.get("max_connections", 4))
+        # Optional instrumentation, published as its own sensor
+        self.diagnostics = None
+        self.diagnostics_entity = None
+        # State and time of the last published diagnostics
+        self.diagnostics_published = (None, 0)
+        if self.args.get("diagnostics"):
+            self.diagnostics = Diagnostics()
+            self.diagnostics_entity = self.args["diagnostics"]
+            if not isinstance(self.diagnostics_entity, str):
+                self.diagnostics_entity = "sensor." + self.name.lower() + "_diagnostics"
+        self.client = BomClient(pool_size=max_connections,
+                                read_timeout=int(self.args.get("http_timeout", 20)),
+                                retries=int(self.args.get("http_retries", 3)),
+                                diagnostics=self.diagnostics)
+        self.executor = ThreadPoolExecutor(max_workers=max_connections)
 
-        # Find the closest location or take config parameter
-        self.location = self.find_closest_location()
-        if "tide_location" in self.args :
-            self.location = self.args["tide_location"]
+        # One station from the app arguments or a list of stations
+        self.stations = []
+        closest = None
+        defaults = {key: value for key, value in self.args.items() if key != "stations"}
+        for entry in self.args.get("stations", [{}]):
+            args = dict(defaults, **entry)
+            # Find the closest location or take config parameter
+            if "tide_location" not in args and closest is None:
+                closest = self.find_closest_location()
+            location = args.get("tide_location", closest)
+            distance = None
+            if location in self.catalogue:
+                distance = self.catalogue.distance(location, config["latitude"], config["longitude"])
+            station = TideStation(args, location, distance)
+            self.set_state(station.actuator,
+                           attributes=station.attribute, state="Unknown")
+            if station.location in self.catalogue:
+                station.tides = self.store.load(station.location, self.tz)
+                station.updated = self.store.fetched(station.location, self.tz)
+                self.stations.append(station)
+                self.schedule_tide_events(station)
+            else:
+                self.log("Location not supported or kown.")
 
-        if self.location in self.location_list:
-            self.tides = []
+        if len(self.stations) > 0:
             # Refresh tidal information very night
             self.time_midnight = "00:00:05"
             self.runtime_midnight = self.parse_time(self.time_midnight)
             self.run_daily(self.refresh_tide_data, self.runtime_midnight)
-            # Start the sensor and refresh every 5min
-            runtime = datetime.now()
-            addseconds = 10
-            runtime = runtime + timedelta(seconds=addseconds)
-            self.run_every(self.get_tide_data, runtime, 360)
-        else:
-            self.log("Location not supported or kown.")
+            # Start the sensors, the next update is picked from the tide curve
+            self.run_in(self.get_tide_data, 10, startup=True)
 
+    def terminate(self):
+        """ Releases the fetch threads and pooled connections.
+        """
+        self.executor.shutdown(wait=False)
+        self.client.close()
 
     def get_tide_data(self, kwargs):
-        """ Update the sensor values.
+        """ Update the sensor values and schedule the next update.
+
+        Every station keeps its own due time, only the stations that are
+        due get updated and the next run is at the earliest due time.
+        Stations without upcoming tides, or on the first run (startup) not
+        holding every day up to the horizon, are refreshed concurrently first.
         """
         try:
-            if len(self.tides) == 0 or self.tides is None:
+            stale = [station for station in self.stations if not station.tides or
+                     self.get_next_tide(station.tides) is None or
+                     (kwargs.get("startup") and self.missing_days(station.tides))]
+            if len(stale) > 0:
                 self.log("No data, refresh triggered")
-                self.tides = self.update_tide_data()
-            # Set values
-            tide, min, time, height, current_height = self.get_next_tide(self.tides)
-            self.attribute.update({"Next tide": tide})
-            self.attribute.update({"Next height": height})
-            self.attribute.update({"Tide time": time})
-            self.attribute.update({"Time in min": min})
-            self.attribute.update({"degree": round(self.scale_values(min, tide)) })
-            self.attribute.update({"location": self.location_list[self.location].get('name') + " (" + str(self.location_list[self.location].get('distance')) + "km)" })
-            self.set_state(self.args["actuator"],
-                        attributes=self.attribute, state=round(current_height, 2))
-        except TimeoutError:
-            self.log("Refresh took too long. Try later.")
+                self.update_stations(stale)
+            now = time.time()
+            for station in self.stations:
+                # Timers fire with some jitter, a second early is due as well
+                if station.due <= now + 1:
+                    # Try again later if the update fails
+                    station.due = now + self.max_interval
+                    station.due = now + self.update_sensor(station)
+            self.publish_diagnostics()
+        finally:
+            due = min((station.due for station in self.stations),
+                      default=time.time() + self.max_interval)
+            self.run_in(self.get_tide_data, max(1, math.ceil(due - time.time())))
+
+    def timed(self, stage):
+        """ Returns a context recording the time of a stage if diagnostics are on.
+        """
+        if self.diagnostics is None:
+            return nullcontext()
+        return self.diagnostics.timed(stage)
+
+    def publish_diagnostics(self):
+        """ Publishes the diagnostics sensor.
+
+        The state is ok, stale (tides older than two days or no upcoming
+        tide) or error (the last update of a station failed). The timings
+        change on every update, so the sensor is only sent when the state
+        changed or the last one is max_interval old.
+        """
+        if self.diagnostics is None:
+            return
+        now = time.time()
+        updated = [station.updated for station in self.stations if station.updated]
+        age = round((now - min(updated)) / 3600, 1) if updated else None
+        state = "ok"
+        if age is None or age > 48 or any(
+                station.tides.next_index(now) >= len(station.tides) for station in self.stations):
+            state = "stale"
+        if len(self.diagnostics.failing) > 0:
+            state = "error"
+        if state == self.diagnostics_published[0] and \
+                now - self.diagnostics_published[1] < self.max_interval:
+            return
+        attribute = self.diagnostics.summary()
+        attribute.update({"data_age_h": age})
+        attribute.update({"event_count": sum(len(station.tides) for station in self.stations)})
+        attribute.update({"stations": len(self.stations)})
+        attribute.update({"cache_" + key: value for key, value in TIDE_CACHE.stats().items()})
+        self.set_state(self.diagnostics_entity, state=state, attributes=attribute)
+        self.diagnostics_published = (state, now)
+
+    def update_sensor(self, station):
+        """ Update the values of one sensor.
+
+        The state is only sent to Home Assistant if the level moved into
+        another state_resolution step, the next tide changed or the last
+        update is about to be max_interval old. Time in min and degree
+        change on every update and follow along, so they are never more
+        than max_interval out of date.
+
+        Parameters:
+            station (TideStation): Sensor to update
+
+        Returns:
+            int: Seconds until the sensor needs the next update
+        """
+        with self.timed("get_next_tide"):
+            next_tide = self.get_next_tide(station.tides)
+        if next_tide is None:
+            self.log("No upcoming tide information available for " + station.location)
+            return self.max_interval
+        # Set values
+        tide, min, tide_time, height, current_height = next_tide
+        attribute = station.attribute
+        attribute.update({"Next tide": tide})
+        attribute.update({"Next height": height})
+        attribute.update({"Tide time": tide_time})
+        attribute.update({"Time in min": min})
+        attribute.update({"degree": round(self.scale_values(min, tide)) })
+        location = " " + self.catalogue.name(station.location)
+        if station.distance is not None:
+            location += " (" + str(station.distance) + "km)"
+        attribute.update({"location": location})
+        state = round(current_height, 2)
+        published = (round(current_height / self.resolution), tide, tide_time, height)
+        now = time.time()
+        # Publish early if the next update could come after max_interval
+        if station.published != published or \
+                now - station.published_at > self.max_interval - self.min_interval:
+            with self.timed("set_state"):
+                self.set_state(station.actuator,
+                            attributes=attribute, state=state)
+            station.published = published
+            station.published_at = now
+        return self.next_update_interval(station)
+
+    def next_update_interval(self, station):
+        """ Picks the time until the next sensor update from the tide curve.
+
+        The next update is due when the level reaches the next
+        state_resolution step: often on the steep mid-tide slope, rarely
+        around slack water, and never later than the next tide event or
+        max_interval after the last published update.
+
+        Parameters:
+            station (TideStation): Sensor to update
+
+        Returns:
+            int: Seconds until the next update
+        """
+        now = time.time()
+        tides = station.tides
+        slope = tides.slope_at(now)
+        interval = self.max_interval
+        if slope != 0:
+            # Time until the level crosses into the next step
+            level = tides.height_at(now)
+            edge = (round(level / self.resolution) + math.copysign(0.5, slope)) * self.resolution
+            interval = (edge - level) / slope + 1
+        index = tides.next_index(now)
+        if index < len(tides):
+            interval = min(interval, tides.epochs[index] - now + 1)
+        if station.published_at is not None:
+            interval = min(interval, station.published_at + self.max_interval - now)
+        return round(min(max(interval, self.min_interval), self.max_interval))
 
     def refresh_tide_data(self, kwargs):
         """ Update the tide information from the website.
@@ -217,13 +1415,140 @@ class SensorTide(hass.Hass):
         This function is called every night to pull the data for the upcoming tides.
         """
         self.log("Nightly refresh triggered")
-        self.tides = self.update_tide_data()
+        self.update_stations(self.stations)
+        self.log("Tide cache " + str(TIDE_CACHE.stats()))
+        self.log("BOM requests " + str(self.client.stats()))
+        self.publish_diagnostics()
+
+    def update_stations(self, stations):
+        """ Updates the tide information of several stations concurrently.
+
+        Parameters:
+            stations (list): Stations to update
+        """
+        for station, tides in zip(stations, self.executor.map(self.update_tide_data, stations)):
+            station.tides = tides
+            self.schedule_tide_events(station)
+
+    def get_station(self, actuator=None):
+        """ Returns the station of a sensor (default the first one).
+        """
+        for station in self.stations:
+            if actuator is None or station.actuator == actuator:
+                return station
+        raise ValueError("Unknown tide sensor " + str(actuator))
+
+    def listen_tide(self, callback, level=None, direction=None, tide=None, offset=0,
+                    actuator=None):
+        """ Registers a callback for a tide level or tide event.
+
+        Other apps can use this instead of polling the sensor, e.g.
+        self.get_app("Tide").listen_tide(self.high_water, level=1.2)
+
+        Parameters:
+            callback (function): Called with a dict describing the trigger
+            level (float): Tide level in m to watch
+            direction (str): Only 'rising' or 'falling' crossings (optional)
+            tide (str): Tide event to watch (high-tide/low-tide)
+            offset (int): Minutes relative to the tide event
+            actuator (str): Sensor to watch (default the first one)
+
+        Returns:
+            dict: Handle for cancel_listen_tide
+        """
+        station = self.get_station(actuator)
+        if level is not None:
+            trigger = {"level": float(level), "direction": direction}
+        else:
+            trigger = {"tide": tide, "offset": int(offset)}
+        trigger["callback"] = callback
+        station.listeners.append(trigger)
+        self.schedule_tide_events(station)
+        return trigger
+
+    def cancel_listen_tide(self, handle):
+        """ Removes a callback registered with listen_tide.
+        """
+        for station in self.stations:
+            if handle in station.listeners:
+                station.listeners.remove(handle)
+                self.schedule_tide_events(station)
+
+    def build_tide_index(self, station, start, end):
+        """ Precomputes the times all triggers of a station fire.
+
+        Parameters:
+            station (TideStation): Station to index
+            start (float): First time in epoch seconds
+            end (float): Last time in epoch seconds
+
+        Returns:
+            list: Sorted tuples of epoch seconds and trigger details
+        """
+        tides = station.tides
+        triggers = [{"level": float(level)} for level in station.args.get("tide_thresholds", [])]
+        for tide, offsets in station.args.get("tide_offsets", {}).items():
+            for offset in offsets:
+                triggers.append({"tide": tide, "offset": int(offset)})
+        triggers += station.listeners
+
+        index = []
+        for trigger in triggers:
+            if "level" in trigger:
+                for epoch, direction in tides.crossings(trigger["level"]):
+                    if trigger.get("direction") in (None, direction):
+                        event = dict(trigger, direction=direction)
+                        index.append((epoch, event))
+            else:
+                for position in range(len(tides)):
+                    if tides.kind(position) == trigger["tide"]:
+                        event = dict(trigger, tide_time=tides.time(position))
+                        index.append((tides.epochs[position] + trigger["offset"] * 60, event))
+        index = [entry for entry in index if start < entry[0] <= end]
+        index.sort(key=lambda entry: entry[0])
+        return index
+
+    def schedule_tide_events(self, station):
+        """ Schedules the precomputed triggers of a station with run_at.
+
+        Parameters:
+            station (TideStation): Station to schedule
+        """
+        for handle in station.timers:
+            self.cancel_timer(handle)
+        station.timers = []
+        now = time.time()
+        station.index = self.build_tide_index(station, now, now + SCHEDULE_AHEAD)
+        for epoch, event in station.index:
+            station.timers.append(self.run_at(
+                self.fire_tide_event, datetime.fromtimestamp(epoch, timezone.utc),
+                actuator=station.actuator, event=event))
+
+    def fire_tide_event(self, kwargs):
+        """ Fires a scheduled trigger.
+
+        Triggers from the app configuration are sent to Home Assistant as
+        tide_threshold / tide_event events, triggers registered with
+        listen_tide call their callback.
+        """
+        station = self.get_station(kwargs["actuator"])
+        event = dict(kwargs["event"])
+        callback = event.pop("callback", None)
+        event["actuator"] = station.actuator
+        event["location"] = station.location
+        if callback is not None:
+            callback(event)
+        elif "level" in event:
+            self.fire_event("tide_threshold", **event)
+        else:
+            self.fire_event("tide_event", **event)
+
 
     def get_next_tide(self, tides):
         """ Returns the next tide details.
 
         Parameters:
-            tides (list): List of tide information
+            tides (TideTable): Tide information
 
         Returns:
             str: Type of next tide (high/low)
@@ -232,57 +1557,105 @@ class SensorTide(hass.Hass):
             float: Height of the next tide in m
             float: Current tidal level in m
         """
-        last_height = 0
-        last_min = 0
-        for entry in tides:
-            next_datetime = datetime.strptime(entry[0], '%Y-%m-%dT%H:%M:%S%z')
-            current_datetime = datetime.now(timezone.utc)
-            delta = (next_datetime - current_datetime).total_seconds()
-            if delta > 0:
-                next_height = entry[2]
-                next_min = round(delta/60)
-                current_height = round(
-                    last_height + (next_height - last_height) *
-                    ((last_min * -1) / (last_min * -1 + next_min)),
-                    2
-                )
-                return entry[1], round(delta/60), entry[0], next_height, current_height
-            else:
-                last_height = entry[2]
-                last_min = round(delta/60)
+        now = time.time()
+        index = tides.next_index(now)
+        if index >= len(tides):
+            return None
+        delta = tides.epochs[index] - now
+        next_height = tides.heights[index]
+        current_height = round(tides.height_at(now), 2)
+        return tides.kind(index), round(delta/60), tides.time(index), next_height, current_height
+
+    def update_tide_data(self, station):
+        """ Gets the tide details of a station from BOM.
 
-    def update_tide_data(self):
-        """ Gets the tide details from BOM.
+        Keeps a rolling window from yesterday up to the configured horizon.
+        Expired events are dropped and only days not already held (e.g. from
+        the local store or the previous night) are fetched. The tide tables
+        are shared through the process-wide cache, so other stations or
+        instances using the same location and time zone reuse the result.
+        If BOM can't be reached, the known tides are kept.
+
+        Parameters:
+            station (TideStation): Station to update
 
         Returns:
-            tides (list): List of tide information
+            tides (TideTable): Tide information
         """
-        tides = []
+        with self.timed("update_tide_data"):
+            return self._update_tide_data(station)
+
+    def _update_tide_data(self, station):
+        tides = station.tides
+        error = None
         try:
-            config = self.get_plugin_config()
-            tz = '&tz='+config["time_zone"]
-            # Get data from day -1 for three days.
-            yesterday = (date.today() + timedelta(days=-1)).strftime("%d-%m-%Y")
-            url = 'http://www.bom.gov.au/australia/tides/print.php?aac=' + \
-                  self.location + '&type=tide&date=' + yesterday + \
-                  tz + '&days=3'
-            # Connect to the URL
-            response = requests.get(url)
-            # Parse HTML and save to BeautifulSoup object
-            soup = BeautifulSoup(response.text, "html.parser")
-            for tag in soup.findAll('tr'):
-                for next in tag.findAll('td'):
-                    att = next['class']
-                    if att[0] == 'localtime' and len(att) == 2:
-                        entry = [next['data-time-local'], att[1]]
-                        tides.append(entry)
-                    if att[0] == 'height' and len(att) == 2:
-                        entry = tides[-1]
-                        entry.append(float(next.text.replace(' m', '')))
-                        tides[-1] = entry
-            return(tides)
-        except:
-            self.log("Error getting tide data: " + url)
+            tides = tides.evict(date.today() + timedelta(days=-1))
+            missing = self.missing_days(tides)
+            changed = len(tides) != len(station.tides)
+            updated = None
+            for start, days in self.fetch_ranges(missing):
+                url = BOM_URL + '?aac=' + \
+                      station.location + '&type=tide&date=' + start + \
+                      '&tz=' + self.tz + '&days=' + str(days)
+                try:
+                    fetched = TIDE_CACHE.get((station.location, self.tz, start, days),
+                                             lambda: self.client.get_tides(url))
+                except Exception as err:
+                    self.log("Error getting tide data: " + url + " (" + repr(err) + ")",
+                             level="WARNING")
+                    error = url + ": " + repr(err)
+                    continue
+                tides = tides.merge(fetched)
+                updated = station.updated = time.time()
+                changed = True
+            if changed:
+                # Only a fetch renews the data age, not dropping expired events
+                self.store.save(station.location, self.tz, tides, fetched=updated)
+        except Exception as err:
+            self.log("Error updating tide data for " + station.location + " (" + repr(err) + ")")
+            error = station.location + ": " + repr(err)
+        if self.diagnostics is not None:
+            # Failures are tracked per station, retries within a request
+            # that succeeded in the end don't count
+            if error is not None:
+                self.diagnostics.error(error, key=station.actuator)
+            else:
+                self.diagnostics.clear(station.actuator)
+        return tides
+
+    def missing_days(self, tides):
+        """ Returns the days from yesterday up to the horizon not held.
+
+        Parameters:
+            tides (TideTable): Tide information
+
+        Returns:
+            list: Sorted list of missing days
+        """
+        first = date.today() + timedelta(days=-1)
+        held = tides.days()
+        window = [first + timedelta(days=day) for day in range(self.horizon + 2)]
+        return [day for day in window if day not in held]
+
+    def fetch_ranges(self, missing):
+        """ Groups missing days into BOM requests.
+
+        Consecutive days are requested together, up to MAX_FETCH_DAYS each.
+
+        Parameters:
+            missing (list): Sorted list of missing days
+
+        Returns:
+            list: Tuples of start date (dd-mm-yyyy) and number of days
+        """
+        ranges = []
+        for day in missing:
+            if ranges and ranges[-1][1] < MAX_FETCH_DAYS and \
+                    ranges[-1][0] + timedelta(days=ranges[-1][1]) == day:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([day, 1])
+        return [(start.strftime("%d-%m-%Y"), days) for start, days in ranges]
 
     def find_closest_location(self):
         """ Find the closest location from the list.
@@ -290,19 +1663,9 @@ class SensorTide(hass.Hass):
         Returns:
             str: Location id
         """
-        location = ""
-        min_distance = None
         config = self.get_plugin_config()
-        base_coords = config["latitude"], config["longitude"]
-        for temp in self.location_list:
-            location_coords = float(self.location_list[temp].get('lat')), float(self.location_list[temp].get('long'))
-            distance = self.haversine(base_coords, location_coords)
-            self.log( temp + " is " + str(distance))
-            if min_distance is None or min_distance > distance:
-                location = temp
-                min_distance = distance
-                self.location_list[location]['distance'] = distance
-        self.log("Closest point " + location + " " + self.location_list[location].get('name') + " being in " + str(self.location_list[location].get('distance')) + "km")
+        location, distance = self.catalogue.nearest(config["latitude"], config["longitude"])[0]
+        self.log("Closest point " + location + "  " + self.catalogue.name(location) + " being in " + str(distance) + "km")
         return location
 
     def scale_values(self, next_min, next_tide):
@@ -0,0 +1,438 @@
+""" Benchmarks for the tide sensor.
+
+Runs the hot paths of sensor_tide against generated or recorded BOM print
+pages and a stand-in for hass.Hass, so no network access (and no AppDaemon
+install) is needed. Pages are served from a local stub server, so the fetch
+stage runs through the real HTTP client.
+
+    python sensor_tide_bench.py
+    python sensor_tide_bench.py --stations 1 100 --days 3 30
+    python sensor_tide_bench.py --fixtures tests/fixtures --profile tide.prof
+
+Recorded pages are saved BOM print.php responses (*.html). The pages in
+tests/fixtures are always run through the parser stage. Their dates are
+fixed, so the next tide lookup may find no upcoming tide for old pages.
+"""
+from datetime import date, datetime, timedelta, timezone
+import argparse
+import cProfile
+import glob
+import http.server
+import math
+import os
+import pstats
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from urllib.parse import parse_qs, urlparse
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures")
+
+
+class FakeHass:
+    """ Stand-in for hass.Hass, timers and states are only recorded.
+    """
+    def __init__(self, args=None, config=None, name="tide_bench"):
+        self.name = name
+        self.args = args or {}
+        self.config = config or {"time_zone": "Australia/Sydney",
+                                 "latitude": -33.86, "longitude": 151.21}
+        self.states = {}
+        self.timers = []
+
+    def log(self, msg, level="INFO"):
+        pass
+
+    def get_plugin_config(self):
+        return self.config
+
+    def set_state(self, entity, **kwargs):
+        self.states[entity] = kwargs
+
+    def parse_time(self, value):
+        return value
+
+    def run_daily(self, callback, start, **kwargs):
+        return self._timer(callback, start, kwargs)
+
+    def run_in(self, callback, delay, **kwargs):
+        return self._timer(callback, delay, kwargs)
+
+    def run_at(self, callback, start, **kwargs):
+        return self._timer(callback, start, kwargs)
+
+    def cancel_timer(self, handle):
+        self.timers[handle] = None
+
+    def fire_event(self, event, **kwargs):
+        pass
+
+    def _timer(self, callback, when, kwargs):
+        self.timers.append((callback, when, kwargs))
+        return len(self.timers) - 1
+
+
+def install_fake_appdaemon():
+    """ Registers FakeHass as appdaemon if AppDaemon is not installed, so
+    sensor_tide can be imported.
+    """
+    try:
+        import globals  # noqa: F401
+    except ImportError:
+        sys.modules["globals"] = types.ModuleType("globals")
+    try:
+        import appdaemon.plugins.hass.hassapi  # noqa: F401
+        return
+    except ImportError:
+        pass
+    hassapi = types.ModuleType("appdaemon.plugins.hass.hassapi")
+    hassapi.Hass = FakeHass
+    for name in ("appdaemon", "appdaemon.plugins", "appdaemon.plugins.hass"):
+        sys.modules.setdefault(name, types.ModuleType(name))
+    sys.modules["appdaemon.plugins.hass.hassapi"] = hassapi
+
+
+_APP_CLASS = None
+
+
+def make_app(args, config=None):
+    """ Builds a SensorTide app on FakeHass.
+
+    The real hass.Hass needs a running AppDaemon, so the app methods are
+    rebased onto FakeHass even when AppDaemon is installed.
+
+    Parameters:
+        args (dict): App arguments
+        config (dict): Home Assistant config (optional)
+
+    Returns:
+        SensorTide: App, initialize is not called
+    """
+    global _APP_CLASS
+    if _APP_CLASS is None:
+        install_fake_appdaemon()
+        import sensor_tide
+        namespace = {key: value for key, value in vars(sensor_tide.SensorTide).items()
+                     if key not in ("__dict__", "__weakref__")}
+        _APP_CLASS = type("SensorTide", (FakeHass,), namespace)
+    return _APP_CLASS(args=args, config=config)
+
+
+def make_print_page(days=3, start=None, utc_offset=10):
+    """ Builds a page laid out like the BOM tide print page.
+
+    Parameters:
+        days (int): Number of days in the table
+        start (date): First day of the table
+        utc_offset (int): Offset of the local time in hours
+
+    Returns:
+        str: HTML page
+    """
+    start = start or date.today() - timedelta(days=1)
+    tz = timezone(timedelta(hours=utc_offset))
+    moment = datetime.combine(start, datetime.min.time(), tz) + timedelta(hours=2)
+    end = moment + timedelta(days=days)
+    kind = 'high-tide'
+    parts = ['<html><head><title>Tide Predictions</title></head><body>',
+             '<div id="content">' + '<p>Bureau of Meteorology</p>' * 20]
+    day = None
+    while moment < end:
+        if moment.date() != day:
+            if day is not None:
+                parts.append('</tbody></table>')
+            day = moment.date()
+            parts.append('<table class="tide-days"><thead><tr><th colspan="3">' +
+                         day.strftime('%A %d %B') + '</th></tr></thead><tbody>')
+        height = 1.1 + 0.8 * math.sin(moment.timestamp() / 40000.0)
+        if kind == 'low-tide':
+            height = 1.6 - height
+        parts.append('<tr><th>' + kind.split('-')[0].title() + '</th>'
+                     '<td class="localtime ' + kind + '" data-time-local="' +
+                     moment.isoformat() + '">' + moment.strftime('%I:%M %p') +
+                     '</td><td class="height ' + kind + '">' +
+                     '%.2f m' % height + '</td></tr>')
+        kind = 'low-tide' if kind == 'high-tide' else 'high-tide'
+        moment += timedelta(minutes=372)
+    parts.append('</tbody></table></div></body></html>')
+    return ''.join(parts)
+
+
+def parse_with_beautifulsoup(text):
+    """ The tree based parser the sensor used before the streaming one.
+    """
+    from bs4 import BeautifulSoup
+    tides = []
+    soup = BeautifulSoup(text, "html.parser")
+    for tag in soup.find_all('tr'):
+        for next in tag.find_all('td'):
+            att = next['class']
+            if att[0] == 'localtime' and len(att) == 2:
+                tides.append([next['data-time-local'], att[1]])
+            if att[0] == 'height' and len(att) == 2:
+                tides[-1].append(float(next.text.replace(' m', '')))
+    return tides
+
+
+def chunked(text, size=8192):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def measure(func, repeat):
+    """ Runs func repeat times.
+
+    Returns:
+        float: Median runtime in ms
+        float: Peak memory in KiB
+    """
+    samples = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - begin) * 1000)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return statistics.median(samples), peak
+
+
+def load_fixtures(path=FIXTURES):
+    """ Reads the recorded BOM print pages (*.html) of a directory.
+
+    Returns:
+        list: Pages as bytes
+    """
+    pages = []
+    for name in sorted(glob.glob(os.path.join(path, "*.html"))):
+        with open(name, "rb") as file:
+            pages.append(file.read())
+    return pages
+
+
+def bench_parser(repeat=20):
+    """ Compares the streaming parser with the BeautifulSoup path on the
+    recorded pages and on generated pages of 3 to 60 days.
+    """
+    import sensor_tide
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        bs4 = None
+        print("bs4 not installed, streaming parser only")
+    pages = [("rec", page.decode()) for page in load_fixtures()]
+    pages += [(days, make_print_page(days)) for days in (3, 7, 30, 60)]
+    print("parser: days  streaming ms  KiB      bs4 ms  KiB")
+    for days, page in pages:
+        chunks = chunked(page)
+        tides = sensor_tide.parse_tide_table(chunks)
+        stream = measure(lambda: sensor_tide.parse_tide_table(chunks), repeat)
+        line = "        %4s  %12.2f  %6.0f" % (days, stream[0], stream[1])
+        if bs4 is not None:
+            if parse_with_beautifulsoup(page) != tides:
+                raise AssertionError("Parsers disagree for %s days" % days)
+            tree = measure(lambda: parse_with_beautifulsoup(page), repeat)
+            line += "  %6.2f  %6.0f" % tree
+        print(line)
+
+
+class PageServer(http.server.ThreadingHTTPServer):
+    """ Local stand-in for the BOM print page.
+
+    Serves the recorded pages in turn, or generates a page for the
+    requested date and number of days.
+
+    Parameters
+    ----------
+    fixtures: list
+        Recorded pages (optional)
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures=None):
+        super().__init__(("127.0.0.1", 0), PageHandler)
+        self.fixtures = fixtures or []
+        self.pages = {}
+        self.served = 0
+
+    def page(self, query):
+        if self.fixtures:
+            self.served += 1
+            return self.fixtures[self.served % len(self.fixtures)]
+        start = datetime.strptime(query["date"][0], "%d-%m-%Y").date()
+        key = (start, int(query["days"][0]))
+        if key not in self.pages:
+            self.pages[key] = make_print_page(key[1], start).encode()
+        return self.pages[key]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent separately, don't wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = self.server.page(parse_qs(urlparse(self.path).query))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_stage(name, stations, days, count, operation, setup=None):
+    """ Times a stage and prints its throughput, latency and peak memory.
+
+    Parameters:
+        name (str): Stage name
+        stations (int): Number of stations
+        days (int): Days of tides held (or None)
+        count (int): Number of operations
+        operation (callable): Called with the operation number
+        setup (callable): Called before every pass (optional)
+    """
+    if setup:
+        setup()
+    samples = []
+    begin = time.perf_counter()
+    for number in range(count):
+        start = time.perf_counter()
+        operation(number)
+        samples.append((time.perf_counter() - start) * 1000)
+    total = time.perf_counter() - begin
+    # Memory is traced in a second pass, tracing slows the code down
+    if setup:
+        setup()
+    tracemalloc.start()
+    for number in range(count):
+        operation(number)
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    samples.sort()
+    print("%-13s %8d %5s %12.0f %9.3f %9.3f %9.0f" % (
+        name, stations, "-" if days is None else days, count / total,
+        samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        peak))
+
+
+def bench_stages(station_counts=(1, 10, 100, 500), day_counts=(3, 7, 30, 60),
+                 fixtures=None):
+    """ Runs every stage for each number of stations and days held.
+
+    Stages: parse (BOM page to TideTable), update_tide_data (stub server,
+    cold cache), get_next_tide, update_sensor, find_closest_location,
+    haversine and scale_values.
+    """
+    import sensor_tide
+    print("stage         stations  days        ops/s   p50 ms    p99 ms  peak KiB")
+    with PageServer(fixtures) as server, tempfile.TemporaryDirectory() as store:
+        sensor_tide.BOM_URL = "http://127.0.0.1:%d/print.php" % server.server_port
+        for count in station_counts:
+            for days in day_counts:
+                page = fixtures[0].decode() if fixtures else make_print_page(days)
+                chunks = chunked(page)
+                run_stage("parse", count, days, count, lambda number:
+                          sensor_tide.TideTable.from_entries(sensor_tide.parse_tide_table(chunks)))
+
+                app = make_app({
+                    "stations": [{"actuator": "sensor.tide_%d" % number,
+                                  "tide_location": sensor_tide.LOCATIONS[
+                                      number % len(sensor_tide.LOCATIONS)][0]}
+                                 for number in range(count)],
+                    "tide_store": store, "tide_horizon": max(days - 2, 0)})
+                app.initialize()
+
+                def cold_start():
+                    sensor_tide.TIDE_CACHE = sensor_tide.TideCache(max_entries=1024)
+                    for station in app.stations:
+                        station.tides = sensor_tide.TideTable()
+
+                def update(number):
+                    station = app.stations[number]
+                    station.tides = app.update_tide_data(station)
+
+                run_stage("update_tide", count, days, count, update, cold_start)
+                run_stage("next_tide", count, days, count, lambda number:
+                          app.get_next_tide(app.stations[number].tides))
+                run_stage("update_sensor", count, days, count, lambda number:
+                          app.update_sensor(app.stations[number]))
+                app.terminate()
+
+            run_stage("closest", count, None, count, lambda number: app.find_closest_location())
+            run_stage("haversine", count, None, count, lambda number: app.haversine(
+                (-33.86, 151.21), sensor_tide.LOCATIONS[number % len(sensor_tide.LOCATIONS)][1:3]))
+            run_stage("scale_values", count, None, count, lambda number:
+                      app.scale_values(number % 375, 'high-tide'))
+
+
+def bench_startup(counts=(1, 10, 100, 500)):
+    """ Measures initialize time and memory per app instance.
+
+    The station catalogue is shared, so both should stay flat as the number
+    of instances grows.
+    """
+    import sensor_tide
+    print("startup: instances  ms/instance  KiB/instance")
+    with tempfile.TemporaryDirectory() as store:
+        for count in counts:
+            apps = []
+            tracemalloc.start()
+            begin = time.perf_counter()
+            for number in range(count):
+                app = make_app({
+                    "actuator": "sensor.tide_%d" % number,
+                    "tide_location": sensor_tide.LOCATIONS[number % len(sensor_tide.LOCATIONS)][0],
+                    "tide_store": store})
+                app.initialize()
+                apps.append(app)
+            elapsed = (time.perf_counter() - begin) * 1000
+            used = tracemalloc.get_traced_memory()[0] / 1024
+            tracemalloc.stop()
+            print("         %9d  %11.3f  %12.1f" % (count, elapsed / count, used / count))
+            for app in apps:
+                app.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for sensor_tide")
+    parser.add_argument("--stations", type=int, nargs="+", default=[1, 10, 100, 500],
+                        help="numbers of stations")
+    parser.add_argument("--days", type=int, nargs="+", default=[3, 7, 30, 60],
+                        help="days of tides held")
+    parser.add_argument("--fixtures", help="directory with recorded BOM print pages (*.html)")
+    parser.add_argument("--profile", help="write cProfile statistics to this file")
+    args = parser.parse_args()
+
+    install_fake_appdaemon()
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else None
+
+    profile = cProfile.Profile() if args.profile else None
+    if profile:
+        profile.enable()
+    bench_parser()
+    bench_startup(args.stations)
+    bench_stages(args.stations, args.days, fixtures)
+    if profile:
+        profile.disable()
+        profile.dump_stats(args.profile)
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(20)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sensor_tide_bench  # noqa: E402
+
+# sensor_tide imports AppDaemon, use the benchmark stand-in where it is missing
+sensor_tide_bench.install_fake_appdaemon()
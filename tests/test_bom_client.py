@@ -0,0 +1,106 @@
+import gzip
+import http.server
+import time
+
+import pytest
+import requests
+
+import sensor_tide
+import sensor_tide_bench
+
+
+class ScriptedHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.seen.append(dict(self.headers))
+        step = self.server.script.pop(0)
+        try:
+            step(self)
+        except OSError:
+            # The client gave up waiting
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(sensor_tide_bench.PageServer):
+    """ Answers every request with the next step of a script. """
+
+    def __init__(self, script):
+        super().__init__()
+        self.RequestHandlerClass = ScriptedHandler
+        self.script = list(script)
+        self.seen = []
+
+
+PAGE = sensor_tide_bench.load_fixtures()[0]
+
+
+def unavailable(handler):
+    handler.send_response(503)
+    handler.send_header("Content-Length", "0")
+    handler.end_headers()
+
+
+def gzipped(handler):
+    body = gzip.compress(PAGE)
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/html; charset=utf-8")
+    handler.send_header("Content-Encoding", "gzip")
+    handler.send_header("ETag", '"tp007-1"')
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def not_modified(handler):
+    handler.send_response(304)
+    handler.send_header("ETag", '"tp007-1"')
+    handler.end_headers()
+
+
+def hanging(handler):
+    time.sleep(1)
+    unavailable(handler)
+
+
+def test_retry_revalidate_and_timeout():
+    script = [unavailable, gzipped, not_modified, hanging, hanging]
+    with StubServer(script) as server:
+        url = "http://127.0.0.1:%d/print.php?aac=NSW_TP007" % server.server_port
+        client = sensor_tide.BomClient(read_timeout=0.3, retries=1, backoff=0)
+
+        # 503 is retried, the page comes gzip compressed
+        tides = client.get_tides(url)
+        assert len(tides) == 11
+        assert "gzip" in server.seen[1]["Accept-Encoding"]
+        stats = client.stats()
+        assert (stats["requests"], stats["failures"], stats["retries"]) == (2, 1, 1)
+        assert 0 < stats["bytes"] < len(PAGE)
+
+        # Revalidated with the ETag, the 304 reuses the parsed table
+        assert client.get_tides(url) is tides
+        assert server.seen[2]["If-None-Match"] == '"tp007-1"'
+        assert client.stats()["not_modified"] == 1
+
+        # Timeouts are retried and then raised to the caller
+        with pytest.raises(requests.Timeout):
+            client.get_tides(url)
+        stats = client.stats()
+        assert (stats["requests"], stats["failures"], stats["retries"]) == (5, 3, 2)
+        assert server.script == []
+        client.close()
+
+
+def test_retried_failure_is_not_an_error():
+    diagnostics = sensor_tide.Diagnostics()
+    with StubServer([unavailable, gzipped]) as server:
+        client = sensor_tide.BomClient(retries=1, backoff=0, diagnostics=diagnostics)
+        client.get_tides("http://127.0.0.1:%d/print.php" % server.server_port)
+        client.close()
+    summary = diagnostics.summary()
+    assert summary["fetch_failures"] == 1
+    assert summary["last_error"] is None and summary["failing"] == []
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import sensor_tide
+
+THREADS = 8
+
+
+def run_coalesced(cache, loader):
+    """ Calls get from THREADS threads while the first load is in flight.
+
+    Returns:
+        list: Value or exception of every thread
+    """
+    release = threading.Event()
+    results = []
+
+    def slow_loader():
+        release.wait(5)
+        return loader()
+
+    def get():
+        try:
+            results.append(cache.get("key", slow_loader))
+        except Exception as err:
+            results.append(err)
+
+    threads = [threading.Thread(target=get) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()["coalesced"] < THREADS - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_loads_are_coalesced():
+    cache = sensor_tide.TideCache()
+    calls = []
+    value = object()
+    results = run_coalesced(cache, lambda: calls.append(1) or value)
+    assert len(calls) == 1
+    assert results == [value] * THREADS
+    assert cache.stats() == {"hits": 0, "misses": 1, "coalesced": THREADS - 1, "size": 1}
+    assert cache.get("key", lambda: None) is value
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache = sensor_tide.TideCache()
+    error = sensor_tide.BomServerError("503")
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise error
+
+    results = run_coalesced(cache, failing)
+    assert len(calls) == 1
+    assert all(result is error for result in results) and len(results) == THREADS
+    assert cache.stats()["size"] == 0
+    # The next call loads again
+    assert cache.get("key", lambda: "tides") == "tides"
+
+
+def test_ttl_and_lru(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    cache = sensor_tide.TideCache(ttl=60, max_entries=2)
+    loads = []
+
+    def loader(key):
+        return lambda: loads.append(key) or key
+
+    cache.get("a", loader("a"))
+    clock[0] += 59
+    assert cache.get("a", loader("a")) == "a" and loads == ["a"]
+    clock[0] += 1
+    cache.get("a", loader("a"))
+    assert loads == ["a", "a"]
+
+    # a was used last, b is dropped for c
+    cache.get("b", loader("b"))
+    cache.get("a", loader("a"))
+    cache.get("c", loader("c"))
+    assert cache.stats()["size"] == 2
+    loads.clear()
+    cache.get("a", loader("a"))
+    cache.get("c", loader("c"))
+    assert loads == []
+    cache.get("b", loader("b"))
+    assert loads == ["b"]
+    assert cache.stats() == {"hits": 4, "misses": 5, "coalesced": 0, "size": 2}
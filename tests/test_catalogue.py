@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+import sensor_tide
+
+CATALOGUE = sensor_tide.station_catalogue()
+EDGES = [(-33.86, 151.21), (51.5, 0), (40, -100), (0, 180), (0, -180), (-41, 179.99),
+         (-41, -179.99), (90, 0), (-90, 0), (-89.9, 120), (89.9, -179.9)]
+
+
+def queries(count=500, seed=42):
+    rng = random.Random(seed)
+    points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(count)]
+    return EDGES + points
+
+
+def brute_force(catalogue, lat, long):
+    distances = sensor_tide.haversine_many(lat, long, catalogue.lats, catalogue.longs)
+    return sorted(zip(catalogue.ids, distances), key=lambda entry: entry[1])
+
+
+def test_nearest_matches_brute_force():
+    for lat, long in queries():
+        expected = brute_force(CATALOGUE, lat, long)
+        found = CATALOGUE.nearest(lat, long, count=3)
+        # Ties may come in any order, the distances must agree
+        assert [distance for _, distance in found] == \
+            [distance for _, distance in expected[:3]], (lat, long)
+        assert found[0][0] in [aac for aac, distance in expected if distance == found[0][1]]
+
+
+@pytest.mark.parametrize("radius", [10, 300, 2500, 20000])
+def test_within_matches_brute_force(radius):
+    for lat, long in queries(200, seed=7):
+        expected = [entry for entry in brute_force(CATALOGUE, lat, long) if entry[1] <= radius]
+        assert sorted(CATALOGUE.within(lat, long, radius)) == sorted(expected), (lat, long)
+
+
+def test_station_file(tmp_path):
+    station_file = tmp_path / "stations.csv"
+    station_file.write_text("aac,lat,long,name\n"
+                            "TST_TP001,-16.5,179.95, Date Line\n"
+                            "TST_TP002,-16.5,-179.95, Other Side\n")
+    catalogue = sensor_tide.station_catalogue(str(station_file))
+    assert catalogue is sensor_tide.station_catalogue(str(station_file))
+    assert len(catalogue) == len(CATALOGUE) + 2
+    assert "TST_TP001" not in CATALOGUE
+    assert catalogue.name("TST_TP002") == "Other Side"
+    # Neighbours across the antimeridian
+    found = catalogue.within(-16.5, 180, 10)
+    assert sorted(aac for aac, _ in found) == ["TST_TP001", "TST_TP002"]
+    assert catalogue.nearest(-16.5, -179.9)[0][0] == "TST_TP002"
+
+
+def test_catalogue_is_immutable():
+    with pytest.raises(AttributeError):
+        CATALOGUE.stations = {}
+    with pytest.raises(AttributeError):
+        CATALOGUE.extra = 1
+    with pytest.raises(TypeError):
+        CATALOGUE.stations["NSW_TP001"] = None
+    with pytest.raises(TypeError):
+        CATALOGUE.cells[(0, 0)] = (0,)
+    cell = next(iter(CATALOGUE.cells.values()))
+    assert isinstance(cell, tuple)
+    with pytest.raises(AttributeError):
+        CATALOGUE.stations["NSW_TP001"].lat = 0
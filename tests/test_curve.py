@@ -0,0 +1,22 @@
+import pytest
+
+import sensor_tide
+import sensor_tide_bench
+
+
+def test_empty_table():
+    tides = sensor_tide.TideTable()
+    epochs, levels = tides.curve_range(0, 3600)
+    assert len(epochs) == 0 and len(levels) == 0
+    assert len(tides.curve([0, 60])) == 0
+    with pytest.raises(ValueError):
+        tides.height_at(0)
+
+
+def test_curve_hits_the_extremes():
+    page = sensor_tide_bench.make_print_page(3)
+    tides = sensor_tide.TideTable.from_entries(sensor_tide.parse_tide_table([page]))
+    levels = tides.curve(list(tides.epochs))
+    assert [round(float(level), 6) for level in levels] == list(tides.heights)
+    middle = (tides.epochs[2] + tides.epochs[3]) / 2
+    assert tides.height_at(middle) == pytest.approx((tides.heights[2] + tides.heights[3]) / 2)
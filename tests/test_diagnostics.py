@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+import time
+
+import sensor_tide
+import sensor_tide_bench
+
+TIDES = sensor_tide.TideTable.from_entries(
+    sensor_tide.parse_tide_table([sensor_tide_bench.make_print_page(4)]))
+
+
+def make_app(monkeypatch, tmp_path, down):
+    monkeypatch.setattr(sensor_tide, "TIDE_CACHE", sensor_tide.TideCache())
+    app = sensor_tide_bench.make_app({
+        "stations": [{"actuator": "sensor.tide_1", "tide_location": "NSW_TP001"},
+                     {"actuator": "sensor.tide_7", "tide_location": "NSW_TP007"}],
+        "tide_store": str(tmp_path), "diagnostics": True})
+    app.initialize()
+
+    def get_tides(url):
+        if any(location in url for location in down):
+            raise sensor_tide.BomServerError("503 from " + url)
+        return TIDES
+    app.client.get_tides = get_tides
+    return app
+
+
+def state(app):
+    app.publish_diagnostics()
+    return app.states["sensor.tide_bench_diagnostics"]
+
+
+def test_error_while_any_station_fails(monkeypatch, tmp_path):
+    down = {"NSW_TP001"}
+    app = make_app(monkeypatch, tmp_path, down)
+    # The station finishing last must not hide the failure of the other
+    for order in (app.stations, app.stations[::-1]):
+        for station in order:
+            station.tides = app.update_tide_data(station)
+        assert state(app)["state"] == "error"
+        assert state(app)["attributes"]["failing"] == ["sensor.tide_1"]
+
+    down.clear()
+    for station in app.stations:
+        station.tides = sensor_tide.TideTable()
+        station.tides = app.update_tide_data(station)
+    assert state(app)["state"] == "ok"
+    assert state(app)["attributes"]["failing"] == []
+    assert "NSW_TP001" in state(app)["attributes"]["last_error"]
+    app.terminate()
+
+
+def test_data_age_after_restart_without_fetch(monkeypatch, tmp_path):
+    store = sensor_tide.TideStore(str(tmp_path))
+    fetched = time.time() - 3 * 86400
+    page = sensor_tide_bench.make_print_page(8, date.today() - timedelta(days=4))
+    tides = sensor_tide.TideTable.from_entries(sensor_tide.parse_tide_table([page]))
+    for location in ("NSW_TP001", "NSW_TP007"):
+        store.save(location, "Australia/Sydney", tides, fetched=fetched)
+    # BOM is down after the restart, the eviction rewrites the store
+    app = make_app(monkeypatch, tmp_path, {"NSW_TP001", "NSW_TP007"})
+    for station in app.stations:
+        station.tides = app.update_tide_data(station)
+    app.terminate()
+
+    app = make_app(monkeypatch, tmp_path, {"NSW_TP001", "NSW_TP007"})
+    attributes = state(app)["attributes"]
+    assert attributes["data_age_h"] >= 72
+    app.terminate()
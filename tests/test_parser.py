@@ -0,0 +1,47 @@
+import glob
+import json
+import os
+
+import pytest
+
+import sensor_tide
+import sensor_tide_bench
+
+PAGES = sorted(glob.glob(os.path.join(sensor_tide_bench.FIXTURES, "*.html")))
+
+
+def expected(page):
+    with open(os.path.splitext(page)[0] + ".json") as file:
+        return json.load(file)
+
+
+def read(page):
+    with open(page, encoding="utf-8") as file:
+        return file.read()
+
+
+def test_fixtures_present():
+    assert PAGES, "no BOM print pages in " + sensor_tide_bench.FIXTURES
+
+
+@pytest.mark.parametrize("page", PAGES, ids=os.path.basename)
+@pytest.mark.parametrize("size", [1, 7, 8192])
+def test_streaming_parser(page, size):
+    # Chunks of any size, tags and entities may be split between them
+    chunks = sensor_tide_bench.chunked(read(page), size)
+    assert sensor_tide.parse_tide_table(chunks) == expected(page)
+
+
+@pytest.mark.parametrize("page", PAGES, ids=os.path.basename)
+def test_beautifulsoup_parity(page):
+    pytest.importorskip("bs4", reason="bs4 not installed, parity with the old parser not checked")
+    text = read(page)
+    assert sensor_tide_bench.parse_with_beautifulsoup(text) == sensor_tide.parse_tide_table([text])
+
+
+def test_generated_pages_parity():
+    pytest.importorskip("bs4", reason="bs4 not installed, parity with the old parser not checked")
+    for days in (1, 3, 30):
+        page = sensor_tide_bench.make_print_page(days)
+        assert sensor_tide_bench.parse_with_beautifulsoup(page) == \
+            sensor_tide.parse_tide_table(sensor_tide_bench.chunked(page))
@@ -0,0 +1,106 @@
+import time
+
+import sensor_tide
+import sensor_tide_bench
+
+START = 1590969600  # 2020-06-01 00:00 UTC
+HOURS = 6
+
+
+def tide_table(low=0.2, high=2.0, days=2):
+    """ Alternating tides every 6 h 12 min around START. """
+    events = []
+    for number in range(-2, days * 4):
+        kind = number % 2
+        events.append((START + number * 372 * 60, 600, kind, high if kind else low))
+    return sensor_tide.TideTable.from_events(events)
+
+
+def simulate(monkeypatch, tmp_path, tables, published=None, **args):
+    """ Runs the update loop for HOURS with a fake clock.
+
+    Every set_state is added to published (optional) as time, sensor and
+    Time in min.
+
+    Returns:
+        dict: Number of set_state calls per sensor
+    """
+    clock = [START]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    app = sensor_tide_bench.make_app(dict({
+        "stations": [{"actuator": "sensor.tide_%d" % number, "tide_location": "NSW_TP007"}
+                     for number in range(len(tables))],
+        "tide_store": str(tmp_path)}, **args))
+    app.initialize()
+    for station, table in zip(app.stations, tables):
+        station.tides = table
+    calls = {station.actuator: 0 for station in app.stations}
+
+    def set_state(entity, **kwargs):
+        calls[entity] = calls.get(entity, 0) + 1
+        if published is not None:
+            published.append((clock[0], entity, kwargs["attributes"]["Time in min"]))
+    app.set_state = set_state
+
+    while clock[0] < START + HOURS * 3600:
+        app.get_tide_data({})
+        callback, delay, kwargs = app.timers[-1]
+        assert callback == app.get_tide_data
+        assert 1 <= delay <= app.max_interval
+        clock[0] += delay
+    app.terminate()
+    return calls
+
+
+def test_fewer_updates_than_polling(monkeypatch, tmp_path):
+    calls = simulate(monkeypatch, tmp_path, [tide_table()])
+    polling = HOURS * 3600 // 360
+    assert 0 < calls["sensor.tide_0"] < polling
+
+
+def test_updates_follow_resolution(monkeypatch, tmp_path):
+    coarse = simulate(monkeypatch, tmp_path, [tide_table()], state_resolution=0.1)
+    fine = simulate(monkeypatch, tmp_path, [tide_table()], state_resolution=0.02)
+    assert coarse["sensor.tide_0"] < fine["sensor.tide_0"]
+
+
+def test_stations_keep_their_own_pace(monkeypatch, tmp_path):
+    # Ranges from 0.4 m to 3 m, the steep stations must not pace the others
+    tables = [tide_table(1.1 - number * 0.15, 1.5 + number * 0.15) for number in range(10)]
+    alone = [simulate(monkeypatch, tmp_path, [table])["sensor.tide_0"] for table in tables]
+    together = simulate(monkeypatch, tmp_path, tables)
+    for number, calls in enumerate(alone):
+        assert abs(together["sensor.tide_%d" % number] - calls) <= 1
+
+
+def test_location_attribute(monkeypatch, tmp_path):
+    app = sensor_tide_bench.make_app({"actuator": "sensor.tide", "tide_location": "NSW_TP007",
+                                      "tide_store": str(tmp_path)})
+    monkeypatch.setattr(time, "time", lambda: START)
+    app.initialize()
+    app.stations[0].tides = tide_table()
+    app.update_sensor(app.stations[0])
+    location = app.states["sensor.tide"]["attributes"]["location"]
+    assert location.startswith(" Sydney (Fort Denison) (") and location.endswith("km)")
+    assert "None" not in location
+    app.terminate()
+
+
+def test_time_in_min_stays_current(monkeypatch, tmp_path):
+    published = []
+    simulate(monkeypatch, tmp_path, [tide_table(), tide_table(0.9, 1.1)], published)
+    for actuator in ("sensor.tide_0", "sensor.tide_1"):
+        updates = [(moment, minutes) for moment, entity, minutes in published
+                   if entity == actuator]
+        updates.append((START + HOURS * 3600, None))
+        # Around slack water the state holds, Time in min must not lag behind
+        for (moment, minutes), (later, _) in zip(updates, updates[1:]):
+            assert later - moment <= 900, (actuator, moment - START, minutes)
+
+
+def test_diagnostics_not_sent_every_tick(monkeypatch, tmp_path):
+    tables = [tide_table(1.1 - number * 0.15, 1.5 + number * 0.15) for number in range(10)]
+    calls = simulate(monkeypatch, tmp_path, tables, diagnostics=True)
+    # The state holds (no fetch time), so only every max_interval
+    assert calls.pop("sensor.tide_bench_diagnostics") <= HOURS * 3600 // 900 + 1
+    assert sum(calls.values()) > 100
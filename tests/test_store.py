@@ -0,0 +1,67 @@
+import threading
+
+import sensor_tide
+import sensor_tide_bench
+
+
+def test_concurrent_saves_of_one_station(tmp_path):
+    page = sensor_tide_bench.make_print_page(30)
+    tides = sensor_tide.TideTable.from_entries(sensor_tide.parse_tide_table([page]))
+    store = sensor_tide.TideStore(str(tmp_path))
+    errors = []
+
+    def save():
+        for _ in range(100):
+            try:
+                store.save("NSW_TP001", "Australia/Sydney", tides)
+            except Exception as err:
+                errors.append(err)
+
+    threads = [threading.Thread(target=save) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [path.name for path in tmp_path.iterdir()] == ["NSW_TP001_Australia_Sydney.tides"]
+    assert list(store.load("NSW_TP001", "Australia/Sydney").events()) == list(tides.events())
+
+
+def test_warm_start_fetches_missing_horizon_days(tmp_path):
+    store = sensor_tide.TideStore(str(tmp_path))
+    # Both hold upcoming tides, only the second covers yesterday up to the horizon
+    for location, days in (("NSW_TP001", 3), ("NSW_TP007", 6)):
+        page = sensor_tide_bench.make_print_page(days)
+        store.save(location, "Australia/Sydney",
+                   sensor_tide.TideTable.from_entries(sensor_tide.parse_tide_table([page])))
+    app = sensor_tide_bench.make_app({
+        "stations": [{"actuator": "sensor.tide_1", "tide_location": "NSW_TP001"},
+                     {"actuator": "sensor.tide_7", "tide_location": "NSW_TP007"}],
+        "tide_store": str(tmp_path), "tide_horizon": 3})
+    app.initialize()
+    refreshed = []
+    app.update_stations = lambda stations: refreshed.extend(
+        station.location for station in stations)
+
+    callback, delay, kwargs = app.timers[-1]
+    callback(kwargs)
+    assert refreshed == ["NSW_TP001"]
+
+    # Later runs only refresh stations without upcoming tides
+    refreshed.clear()
+    app.get_tide_data({})
+    assert refreshed == []
+    app.terminate()
+
+
+def test_fetch_time_survives_saves_without_fetch(tmp_path):
+    page = sensor_tide_bench.make_print_page(5)
+    tides = sensor_tide.TideTable.from_entries(sensor_tide.parse_tide_table([page]))
+    store = sensor_tide.TideStore(str(tmp_path))
+    assert store.fetched("NSW_TP001", "Australia/Sydney") is None
+    store.save("NSW_TP001", "Australia/Sydney", tides, fetched=1590969600.5)
+    # Dropping expired events rewrites the events only
+    store.save("NSW_TP001", "Australia/Sydney", tides.evict(tides.days().pop()))
+    assert sensor_tide.TideStore(str(tmp_path)).fetched(
+        "NSW_TP001", "Australia/Sydney") == 1590969600.5
@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+import time
+
+import pytest
+
+import sensor_tide
+import sensor_tide_bench
+
+START = 1590969600  # 2020-06-01 00:00 UTC, a low tide
+CYCLE = 372 * 60  # Between a low and the next high tide
+
+
+def tide_table(low=0.2, high=2.0):
+    events = [(START + number * CYCLE, 600, number % 2, high if number % 2 else low)
+              for number in range(-2, 12)]
+    return sensor_tide.TideTable.from_events(events)
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    monkeypatch.setattr(time, "time", lambda: START)
+    app = sensor_tide_bench.make_app({
+        "actuator": "sensor.tide", "tide_location": "NSW_TP007", "tide_store": str(tmp_path),
+        "tide_thresholds": [1.1], "tide_offsets": {"low-tide": [-120]}})
+    app.initialize()
+    app.stations[0].tides = tide_table()
+    app.schedule_tide_events(app.stations[0])
+    yield app
+    app.terminate()
+
+
+def scheduled(app):
+    return [(when, kwargs["event"]) for callback, when, kwargs in
+            filter(None, app.timers) if callback == app.fire_tide_event]
+
+
+def test_crossings():
+    tides = tide_table()
+    found = tides.crossings(1.1)
+    # The middle level is crossed half way between the tides
+    assert [epoch - START for epoch, _ in found][2:6] == \
+        pytest.approx([CYCLE / 2, CYCLE * 3 / 2, CYCLE * 5 / 2, CYCLE * 7 / 2])
+    assert [direction for _, direction in found][2:6] == ['rising', 'falling', 'rising', 'falling']
+    for level in (0.3, 1.1, 1.9):
+        crossings = tides.crossings(level)
+        assert len(crossings) == len(tides) - 1
+        for epoch, _ in crossings:
+            assert tides.height_at(epoch) == pytest.approx(level)
+    assert tides.crossings(2.5) == [] and tides.crossings(0.1) == []
+
+
+def test_offsets_and_thresholds(app):
+    events = scheduled(app)
+    offsets = [when for when, event in events if "tide" in event]
+    thresholds = [when for when, event in events if "level" in event]
+    lows = [START + number * CYCLE for number in range(2, 10, 2)]
+    # Two hours before every low tide of the next two days
+    assert len(offsets) == 4
+    assert offsets == [datetime.fromtimestamp(low - 7200, timezone.utc)
+                       for low in lows if low - 7200 <= START + sensor_tide.SCHEDULE_AHEAD]
+    assert thresholds[0] == datetime.fromtimestamp(START + CYCLE / 2, timezone.utc)
+    assert [event["direction"] for when, event in events if "level" in event][:2] == \
+        ['rising', 'falling']
+
+
+def test_direction_filter(app):
+    handle = app.listen_tide(lambda event: None, level=1.1, direction='falling')
+    own = [event for when, event in scheduled(app) if event.get("callback")]
+    assert own and all(event["direction"] == 'falling' for event in own)
+    app.cancel_listen_tide(handle)
+    assert not any(event.get("callback") for when, event in scheduled(app))
+
+
+def test_old_timers_cancelled(app, monkeypatch):
+    station = app.stations[0]
+    old = list(station.timers)
+    cancelled = []
+    cancel_timer = app.cancel_timer
+    app.cancel_timer = lambda handle: (cancelled.append(handle), cancel_timer(handle))
+    # New tides half an hour later replace every scheduled trigger
+    monkeypatch.setattr(app, "update_tide_data", lambda station: sensor_tide.TideTable.from_events(
+        (epoch + 1800, offset, kind, height) for epoch, offset, kind, height in tide_table().events()))
+    app.update_stations([station])
+    assert sorted(cancelled) == sorted(old)
+    assert all(app.timers[handle] is None for handle in old)
+    assert scheduled(app)[0][0] == datetime.fromtimestamp(START + 1800 + CYCLE / 2, timezone.utc)
+
+
+def test_fire_tide_event(app):
+    fired = []
+    app.fire_event = lambda event, **kwargs: fired.append((event, kwargs))
+    received = []
+    app.listen_tide(received.append, tide='high-tide', offset=-30)
+    for callback, when, kwargs in filter(None, list(app.timers)):
+        if callback == app.fire_tide_event:
+            callback(kwargs)
+
+    threshold = [kwargs for event, kwargs in fired if event == "tide_threshold"]
+    assert threshold[0] == {"level": 1.1, "direction": 'rising',
+                            "actuator": "sensor.tide", "location": "NSW_TP007"}
+    offset = [kwargs for event, kwargs in fired if event == "tide_event"]
+    assert offset and all(kwargs["tide"] == 'low-tide' and kwargs["offset"] == -120
+                          for kwargs in offset)
+    # listen_tide triggers call back instead of firing an event
+    assert len(fired) == len(threshold) + len(offset)
+    assert received and all(event["tide"] == 'high-tide' and event["offset"] == -30 and
+                            event["actuator"] == "sensor.tide" for event in received)